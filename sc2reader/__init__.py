@@ -2,22 +2,29 @@
 from __future__ import absolute_import
 
 import sys, os
+import importlib
+import threading
+from types import ModuleType
 
-# import submodules
-from sc2reader import plugins, data, scripts
-from sc2reader import factories, log_utils
+__version__ = '0.5.1'
+
+from sc2reader import log_utils
 
 # setup the library logging
 log_utils.setup()
 
-# For backwards compatibility
-SC2Reader = factories.SC2Factory
+#: The submodules imported the first time they are used instead of on import
+SUBMODULES = ('constants', 'data', 'decoders', 'events', 'exceptions', 'factories', 'objects', 'plugins', 'readers', 'resources', 'scripts', 'utils')
+
+#: The module level interface set by :func:`setFactory`
+FACTORY_NAMES = ('load_replays', 'load_replay', 'peek_replay', 'load_maps', 'load_map', 'load_game_summaries', 'load_game_summary', 'load_map_infos', 'load_map_info', 'load_map_histories', 'load_map_history', 'configure', 'reset', 'register_plugin', '_defaultFactory')
 
 def setFactory(factory):
     # Expose a nice module level interface
     module = sys.modules[__name__]
     module.load_replays = factory.load_replays
     module.load_replay = factory.load_replay
+    module.peek_replay = factory.peek_replay
     module.load_maps = factory.load_maps
     module.load_map = factory.load_map
     module.load_game_summaries = factory.load_game_summaries
@@ -34,24 +41,74 @@ def setFactory(factory):
     module._defaultFactory = factory
 
 def useFileCache(cache_dir, **options):
+    from sc2reader import factories
     setFactory(factories.FileCachedSC2Factory(cache_dir, **options))
 
 def useDictCache(cache_max_size=0, **options):
+    from sc2reader import factories
     setFactory(factories.DictCachedSC2Factory(cache_max_size, **options))
 
 def useDoubleCache(cache_dir, cache_max_size=0, **options):
+    from sc2reader import factories
     setFactory(factories.DoubleCachedSC2Factory(cache_dir, cache_max_size, **options))
 
+def useParsedCache(cache_dir, cache_max_size=0, **options):
+    from sc2reader import factories
+    setFactory(factories.ParsedCacheSC2Factory(cache_dir, cache_max_size, **options))
+
+def useDefaultFactory():
+    # Allow environment variables to activate caching
+    cache_dir = os.getenv('SC2READER_CACHE_DIR')
+    cache_max_size = os.getenv('SC2READER_CACHE_MAX_SIZE')
+    if cache_dir and cache_max_size:
+        useDoubleCache(cache_dir, cache_max_size)
+    elif cache_dir:
+        useFileCache(cache_dir)
+    elif cache_max_size:
+        useDictCache(cache_max_size)
+    else:
+        from sc2reader import factories
+        setFactory(factories.SC2Factory())
+
+def checkDefaultFactory():
+    # The default factory is created the first time it is used, where a bad
+    # SC2READER_CACHE_DIR would be hidden by hasattr. Check it on import.
+    cache_dir = os.getenv('SC2READER_CACHE_DIR')
+    if cache_dir:
+        cache_dir = os.path.abspath(cache_dir)
+        if not os.path.isdir(cache_dir):
+            raise ValueError("SC2READER_CACHE_DIR ({0}) must be an existing directory.".format(cache_dir))
+        elif not os.access(cache_dir, os.F_OK | os.W_OK | os.R_OK):
+            raise ValueError("Must have read/write access to SC2READER_CACHE_DIR ({0}) for local file caching.".format(cache_dir))
+
+checkDefaultFactory()
+
+_factory_lock = threading.Lock()
+
+class LazyModule(ModuleType):
+    """
+    The sc2reader module. Submodules are imported and the default factory is
+    created the first time they are used so that ``import sc2reader`` only
+    imports what it needs to.
+    """
+    def __getattr__(self, name):
+        if name in SUBMODULES:
+            return importlib.import_module('sc2reader.'+name)
+
+        elif name in FACTORY_NAMES:
+            with _factory_lock:
+                if '_defaultFactory' not in self.__dict__:
+                    useDefaultFactory()
+            return self.__dict__[name]
+
+        elif name == 'SC2Reader':
+            # For backwards compatibility
+            return self.factories.SC2Factory
 
-# Allow environment variables to activate caching
-cache_dir = os.getenv('SC2READER_CACHE_DIR')
-cache_max_size = os.getenv('SC2READER_CACHE_MAX_SIZE')
-if cache_dir and cache_max_size:
-    useDoubleCache(cache_dir, cache_max_size)
-elif cache_dir:
-    useFileCache(cache_dir)
-elif cache_max_size:
-    useDictCache(cache_max_size)
-else:
-    setFactory(factories.SC2Factory())
+        raise AttributeError("'module' object has no attribute '{0}'".format(name))
 
+# Python clears the globals of a module when it is deleted so the original
+# module is kept as _module on its replacement.
+_module = sys.modules[__name__]
+sys.modules[__name__] = LazyModule(__name__, __doc__)
+sys.modules[__name__].__dict__.update(_module.__dict__)
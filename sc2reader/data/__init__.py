@@ -1,13 +1,21 @@
 from __future__ import absolute_import
 
+import os
 import json
+import zlib
+import marshal
+import difflib
+import hashlib
 import pkgutil
+import threading
+from collections import Mapping
 
 try:
     from collections import OrderedDict
 except ImportError as e:
     from ordereddict import OrderedDict
 
+from sc2reader import log_utils
 from sc2reader.log_utils import loggable
 
 ABIL_LOOKUP = dict()
@@ -28,10 +36,61 @@ unit_lookup = json.loads(unit_data)
 command_data = pkgutil.get_data('sc2reader.data', 'train_commands.json')
 train_commands = json.loads(command_data)
 
+class UnitType(object):
+    """
+    Represents an in-game unit type. Identical unit types are shared by
+    every :class:`Build` instead of being created again for each one.
+    """
+    __slots__ = ('id', 'str_id', 'name', 'title', 'race', 'minerals', 'vespene', 'supply', 'is_building', 'is_worker', 'is_army')
+
+    def __init__(self, type_id, str_id, name, title, race, minerals, vespene, supply, is_building, is_worker, is_army):
+        #: The internal integer id of this unit type
+        self.id = type_id
+
+        #: The internal string id of this unit type
+        self.str_id = str_id
+
+        #: The name of this unit type
+        self.name = name
+
+        #: The display name of this unit type
+        self.title = title
+
+        #: The race of this unit type. One of Terran, Protoss, Zerg, or Neutral
+        self.race = race
+
+        #: The mineral cost of this unit type
+        self.minerals = minerals
+
+        #: The vespene cost of this unit type
+        self.vespene = vespene
+
+        #: The supply used by this unit type. Negative for supply providers.
+        self.supply = supply
+
+        #: Boolean flagging this unit type as a building.
+        self.is_building = is_building
+
+        #: Boolean flagging this unit type as a worker. SCV, MULE, Drone, Probe
+        self.is_worker = is_worker
+
+        #: Boolean flagging this unit type as an army unit.
+        self.is_army = is_army
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "UnitType({0}, {1})".format(self.id, self.str_id)
+
+
 class Unit(object):
     """
     Represents an in-game unit.
     """
+    # The __dict__ slot keeps units open to attributes set by plugins. It is
+    # only allocated for units that get one.
+    __slots__ = ('owner', 'started_at', 'finished_at', 'died_at', 'killed_by', 'location', 'id', 'flags', 'hallucinated', '_type_class', '_type_history', '__dict__')
 
     def __init__(self, unit_id, flags):
         #: A reference to the player that owns this unit
@@ -49,6 +108,9 @@ class Unit(object):
         #: A reference to the player that killed this unit. Not always available.
         self.killed_by = None
 
+        #: The last known (x, y) location of this unit. Not always available.
+        self.location = None
+
         #: The unique in-game id for this unit. The id can sometimes be zero because
         #: TargetAbilityEvents will create a new unit with id zero when a unit
         #: behind the fog of war is targetted.
@@ -56,20 +118,24 @@ class Unit(object):
 
         self.flags = flags
 
-        #: A reference to the unit type this unit is current in.
+        #: A reference to the :class:`UnitType` this unit is current in.
         #: e.g. SeigeTank is a different type than SeigeTankSeiged
         self._type_class = None
 
-        #: A history of all the unit types this unit has had stored
-        #: in order by frame the type was acquired.
-        self.type_history = OrderedDict()
-
+        # (frame, unit_type) pairs in the order the types were acquired
+        self._type_history = list()
 
         self.hallucinated = (flags & 2 == 2)
 
+    @property
+    def type_history(self):
+        """ A history of all the unit types this unit has had stored in
+        order by frame the type was acquired. """
+        return OrderedDict(self._type_history)
+
     def set_type(self, unit_type, frame):
         self._type_class = unit_type
-        self.type_history[frame] = unit_type
+        self._type_history.append((frame, unit_type))
 
     def is_type(self, unit_type, strict=True):
         if strict:
@@ -78,7 +144,7 @@ class Unit(object):
                     return unit_type == self._type_class.id
                 else:
                     return unit_type == 0
-            elif isinstance(unit_type, Unit):
+            elif isinstance(unit_type, UnitType):
                 return self._type_class == unit_type
             else:
                 if self._type_class:
@@ -91,7 +157,7 @@ class Unit(object):
                     return unit_type in [utype.id for utype in self.type_history.values()]
                 else:
                     return unit_type == 0
-            elif isinstance(unit_type, Unit):
+            elif isinstance(unit_type, UnitType):
                 return unit_type in self.type_history.values()
             else:
                 if self._type_class:
@@ -161,22 +227,49 @@ class Unit(object):
         return str(self)
 
 
-class Ability(object):
+class AbilityType(object):
+    """
+    Represents an in-game ability. Identical abilities are shared by every
+    :class:`Build` instead of being created again for each one.
+    """
+    __slots__ = ('id', 'name', 'title', 'is_build', 'build_time', 'build_unit')
+
+    def __init__(self, ability_id, name, title, is_build, build_time, build_unit):
+        #: The internal integer id representing this ability.
+        self.id = ability_id
+
+        #: The name of this ability
+        self.name = name
 
-    #: The internal integer id representing this ability.
-    id = None
+        #: The display name of this ability
+        self.title = title
 
-    #: The name of this ability
-    name = ""
+        #: Boolean flagging this ability as creating a new unit.
+        self.is_build = is_build
 
-    #: Boolean flagging this ability as creating a new unit.
-    is_build = False
+        #: The number of seconds required to build this unit. 0 if not ``is_build``.
+        self.build_time = build_time
 
-    #: The number of seconds required to build this unit. 0 if not ``is_build``.
-    build_time = 0
+        #: A reference to the :class:`UnitType` built by this ability. None if not ``is_build``.
+        self.build_unit = build_unit
 
-    #: A reference to the :class:`Unit` type built by this ability. None if not ``is_build``.
-    build_unit = None
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "AbilityType({0}, {1})".format(self.id, self.name)
+
+
+# Unit and ability types are shared between builds, keyed by their values
+_shared_types = dict()
+
+def _get_shared_type(type_class, *values):
+    key = (type_class,)+values
+    shared_type = _shared_types.get(key)
+    if shared_type is None:
+        # setdefault keeps the first type made if builds load in parallel
+        shared_type = _shared_types.setdefault(key, type_class(*values))
+    return shared_type
 
 
 @loggable
@@ -185,8 +278,8 @@ class Build(object):
     :param build_id: The build number identifying this dataset.
 
     The datapack for a particualr group of builds. Maps internal integer ids
-    to :class:`Unit` and :class:`Ability` types. Also contains builder methods
-    for creating new units and changing their types.
+    to :class:`UnitType` and :class:`AbilityType` records. Also contains
+    builder methods for creating new units and changing their types.
 
     All build data is valid for standard games only. For arcade maps milage
     may vary.
@@ -226,39 +319,45 @@ class Build(object):
             self.logger.error("Unable to change type of {0} to {1} [frame {2}]; unit type not found in build {3}".format(unit,new_type,frame,self.id))
 
     def add_ability(self, ability_id, name, title=None, is_build=False, build_time=None, build_unit=None):
-        ability = type(name,(Ability,), dict(
-            id=ability_id,
-            name=name,
-            title=title or name,
-            is_build=is_build,
-            build_time=build_time,
-            build_unit=build_unit
-        ))
+        ability = _get_shared_type(AbilityType, ability_id, name, title or name, is_build, build_time, build_unit)
         setattr(self, name, ability)
         self.abilities[ability_id] = ability
 
     def add_unit_type(self, type_id, str_id, name, title=None, race='Neutral', minerals=0, vespene=0, supply=0, is_building=False, is_worker=False, is_army=False):
-        unit = type(name,(Unit,), dict(
-            id=type_id,
-            str_id=str_id,
-            name=name,
-            title=title or name,
-            race=race,
-            minerals=minerals,
-            vespene=vespene,
-            supply=supply,
-            is_building=is_building,
-            is_worker=is_worker,
-            is_army=is_army,
-        ))
+        unit = _get_shared_type(UnitType, type_id, str_id, name, title or name, race, minerals, vespene, supply, is_building, is_worker, is_army)
         setattr(self, name, unit)
         self.units[type_id] = unit
         self.units[str_id] = unit
 
-def load_build(expansion, version):
-    build = Build(version)
+#: The file holding the compiled datapack snapshot, see :func:`write_snapshot`
+SNAPSHOT_FILE = 'datapacks.marshal'
+
+#: The version of the snapshot format
+SNAPSHOT_FORMAT = 2
+
+#: The data files shared by every build
+LOOKUP_FILES = ('unit_lookup.csv', 'ability_lookup.csv', 'unit_info.json', 'train_commands.json')
+
+def _hash_data_files(data_files):
+    data_hash = hashlib.sha1()
+    for data_file in data_files:
+        data_hash.update(pkgutil.get_data('sc2reader.data', data_file))
+    return data_hash.hexdigest()
+
+def _build_files(expansion, version):
+    return ('{0}/{1}_units.csv'.format(expansion,version), '{0}/{1}_abilities.csv'.format(expansion,version))
 
-    unit_file = '{0}/{1}_units.csv'.format(expansion,version)
+def read_build(expansion, version):
+    """
+    Joins the data files for a build into the arguments for
+    :meth:`Build.add_unit_type` and :meth:`Build.add_ability`. Returns
+    ``(unit_types, abilities)`` where the unit types are keyword argument
+    dicts and the abilities are ``(ability_id, name, title, is_build,
+    build_time, build_unit)`` tuples naming the unit they build.
+    """
+    unit_file, abil_file = _build_files(expansion, version)
+
+    unit_types = list()
     for entry in pkgutil.get_data('sc2reader.data', unit_file).split('\n'):
         if not entry: continue
         int_id, str_id = entry.strip().split(',')
@@ -272,10 +371,9 @@ def load_build(expansion, version):
                 values['race']=race
                 break
 
-        build.add_unit_type(**values)
+        unit_types.append(values)
 
-    abil_file = '{0}/{1}_abilities.csv'.format(expansion,version)
-    build.add_ability(ability_id=0, name='RightClick', title='Right Click')
+    abilities = [(0, 'RightClick', 'Right Click', False, None, '')]
     for entry in pkgutil.get_data('sc2reader.data', abil_file).split('\n'):
         if not entry: continue
         int_id_base, str_id = entry.strip().split(',')
@@ -292,25 +390,232 @@ def load_build(expansion, version):
             if 'Hallucinated' in unit_name: # Not really sure how to handle hallucinations
                 unit_name = unit_name[12:]
 
-            build.add_ability(
-                ability_id=int_id_base | index,
-                name=ability_name,
-                is_build=bool(unit_name),
-                build_unit=getattr(build, unit_name, None),
-                build_time=build_time
-            )
+            abilities.append((int_id_base | index, ability_name, None, bool(unit_name), build_time, unit_name))
+
+    return unit_types, abilities
+
+def _entry_key(entry):
+    return tuple(sorted(entry.items())) if isinstance(entry, dict) else entry
+
+def diff_build(base, build):
+    """
+    :param base: The ``(unit_types, abilities)`` of a base build from :func:`read_build`
+    :param build: The ``(unit_types, abilities)`` of the build to compare
+
+    Returns the changes from the base to the build as ``(unit_type_changes,
+    ability_changes)``. Each is a list of ``(start, end, entries)`` changes
+    that replace the ``start:end`` slice of the base entries with the added
+    and renumbered entries. Entries the builds share aren't included.
+    """
+    changes = list()
+    for base_entries, entries in zip(base, build):
+        matcher = difflib.SequenceMatcher(None, map(_entry_key, base_entries), map(_entry_key, entries), autojunk=False)
+        changes.append([(i1, i2, entries[j1:j2]) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal'])
+    return tuple(changes)
+
+def patch_build(base, changes):
+    """
+    :param base: The ``(unit_types, abilities)`` of a base build
+    :param changes: The changes from :func:`diff_build`
+
+    Applies the changes to the base build and returns the ``(unit_types,
+    abilities)`` of the changed build.
+    """
+    build = list()
+    for base_entries, entry_changes in zip(base, changes):
+        entries, last = list(), 0
+        for start, end, changed in entry_changes:
+            entries.extend(base_entries[last:start])
+            entries.extend(changed)
+            last = end
+        entries.extend(base_entries[last:])
+        build.append(entries)
+    return tuple(build)
+
+def _interned(value):
+    # Interned strings are written once and referenced after that by marshal
+    if isinstance(value, basestring):
+        return intern(str(value))
+    elif isinstance(value, dict):
+        return dict((_interned(key), _interned(item)) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return type(value)(_interned(item) for item in value)
+    else:
+        return value
+
+def write_snapshot(path=None):
+    """
+    :param path: Where to write the snapshot, defaults to the package's :data:`SNAPSHOT_FILE`
+
+    Compiles every build in :data:`builds` into a snapshot that
+    :func:`load_build` reads instead of joining the data files again. Each
+    build is stored as its changes from the build before it in the same
+    expansion. The snapshot records a hash of the data files behind each
+    build and is only used while they match. Run this again after changing
+    the data files.
+    """
+    snapshot = dict(format=SNAPSHOT_FORMAT, lookups=_hash_data_files(LOOKUP_FILES), builds=dict())
+    for expansion, expansion_builds in builds.items():
+        base_version, base = None, (list(), list())
+        for version in expansion_builds:
+            build = read_build(expansion, version)
+            changes = diff_build(base, build)
+            build_hash = _hash_data_files(_build_files(expansion, version))
+            snapshot['builds'][expansion+'/'+version] = _interned((build_hash, base_version, changes))
+            base_version, base = version, build
+
+    path = path or os.path.join(os.path.dirname(__file__), SNAPSHOT_FILE)
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(zlib.compress(marshal.dumps(snapshot, 2), 9))
+
+def _data_files_changed():
+    # The snapshot is written after the data files it is built from so it
+    # only needs to be checked against their hashes when one is newer.
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+    data_files = list(LOOKUP_FILES)
+    for expansion, expansion_builds in builds.items():
+        for version in expansion_builds:
+            data_files.extend(_build_files(expansion, version))
+
+    try:
+        snapshot_time = os.path.getmtime(os.path.join(data_dir, SNAPSHOT_FILE))
+        return any(os.path.getmtime(os.path.join(data_dir, *data_file.split('/'))) > snapshot_time for data_file in data_files)
+    except OSError:
+        # Packages that aren't plain files, zipped eggs for instance
+        return True
+
+def _matching_builds(snapshot_builds):
+    # Keeps the builds that match their data files and are based on builds
+    # that match their data files too.
+    matches = dict()
+    def matching(key):
+        if key not in matches:
+            build_hash, base_version, changes = snapshot_builds[key]
+            expansion, version = key.split('/')
+            base_key = expansion+'/'+(base_version or '')
+            matches[key] = (build_hash == _hash_data_files(_build_files(expansion, version))
+                            and (base_version is None or (base_key in snapshot_builds and matching(base_key))))
+        return matches[key]
+    return dict((key, entry) for key, entry in snapshot_builds.items() if matching(key))
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def get_snapshot():
+    """ Returns the builds in the datapack snapshot that match the current data
+    files. The snapshot is read and checked once and kept. The data files
+    are only hashed to check the snapshot when one of them is newer than it.
+    """
+    global _snapshot
+    logger = log_utils.get_logger(get_snapshot)
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = dict()
+            try:
+                snapshot = marshal.loads(zlib.decompress(pkgutil.get_data('sc2reader.data', SNAPSHOT_FILE)))
+                if snapshot['format'] != SNAPSHOT_FORMAT:
+                    logger.info("Datapack snapshot format {0} is out of date".format(snapshot['format']))
+                elif not _data_files_changed():
+                    _snapshot = snapshot['builds']
+                elif snapshot['lookups'] != _hash_data_files(LOOKUP_FILES):
+                    logger.info("Datapack snapshot doesn't match the lookup data files")
+                else:
+                    _snapshot = _matching_builds(snapshot['builds'])
+            except (IOError, EOFError, ValueError, TypeError, KeyError, zlib.error) as e:
+                logger.info("Datapack snapshot unavailable: {0}".format(e))
+    return _snapshot
+
+def read_snapshot_build(expansion, version):
+    """
+    Returns the ``(unit_types, abilities)`` of a build from the snapshot by
+    applying its changes to the builds before it. Returns None if the build
+    isn't in the snapshot or doesn't match its data files.
+    """
+    build_hash, base_version, changes = get_snapshot().get(expansion+'/'+version, (None, None, None))
+    if changes is None:
+        return None
+    elif base_version is None:
+        return patch_build((list(), list()), changes)
+    else:
+        return patch_build(read_snapshot_build(expansion, base_version), changes)
+
+def load_build(expansion, version):
+    """
+    Loads the :class:`Build` datapack for a version of an expansion from the
+    snapshot when it matches the data files, otherwise from the data files.
+    """
+    return create_build(version, read_snapshot_build(expansion, version) or read_build(expansion, version))
+
+def create_build(version, tables):
+    """
+    Creates the :class:`Build` datapack for a version from its ``(unit_types,
+    abilities)`` tables, see :func:`read_build`.
+    """
+    unit_types, abilities = tables
+    build = Build(version)
+    for values in unit_types:
+        build.add_unit_type(**values)
+
+    for ability_id, name, title, is_build, build_time, build_unit in abilities:
+        build.add_ability(ability_id, name, title, is_build, build_time, getattr(build, build_unit, None))
 
     return build
 
-# Load the WoL Data
-wol_builds = dict()
-for version in ('16117','17326','18092','19458','22612','24944'):
-    wol_builds[version] = load_build('WoL', version)
+class Builds(Mapping):
+    """
+    :param expansion: The expansion the builds belong to
+    :param versions: The versions that have build data files
+
+    A read only mapping of versions to the :class:`Build` datapacks for an
+    expansion. Builds are loaded the first time they are looked up instead of
+    on import. Lookups are thread safe and each build is only loaded once.
+    The tables of each build are kept so that a build in the snapshot is
+    loaded by applying just its own changes to the build it is based on.
+    """
+    def __init__(self, expansion, versions):
+        self.expansion = expansion
+        self.versions = tuple(versions)
+        self._builds = dict()
+        self._tables = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, version):
+        if version not in self._builds:
+            if version not in self.versions:
+                raise KeyError(version)
+            with self._lock:
+                if version not in self._builds:
+                    self._builds[version] = create_build(version, self._read_tables(version))
+        return self._builds[version]
+
+    def _read_tables(self, version):
+        # Called with the lock held
+        if version not in self._tables:
+            build_hash, base_version, changes = get_snapshot().get(self.expansion+'/'+version, (None, None, None))
+            if changes is None:
+                tables = read_build(self.expansion, version)
+            elif base_version is None:
+                tables = patch_build((list(), list()), changes)
+            else:
+                tables = patch_build(self._read_tables(base_version), changes)
+            self._tables[version] = tables
+        return self._tables[version]
+
+    def __contains__(self, version):
+        # Don't load the build just to check for it
+        return version in self.versions
+
+    def __iter__(self):
+        return iter(self.versions)
+
+    def __len__(self):
+        return len(self.versions)
+
+# The WoL Data
+wol_builds = Builds('WoL', ('16117','17326','18092','19458','22612','24944'))
 
-# Load HotS Data
-hots_builds = dict()
-for version in ('base','23925','24247','24764'):
-    hots_builds[version] = load_build('HotS', version)
+# The HotS Data
+hots_builds = Builds('HotS', ('base','23925','24247','24764'))
 
 builds = {'WoL':wol_builds,'HotS':hots_builds}
 
@@ -0,0 +1,10 @@
+"""
+Compiles the datapack snapshot shipped with sc2reader. Run this again after
+changing any of the data files.
+
+    python -m sc2reader.data.create_snapshot
+"""
+from sc2reader.data import write_snapshot
+
+if __name__ == '__main__':
+    write_snapshot()
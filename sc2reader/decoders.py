@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+from binascii import hexlify, unhexlify
 from cStringIO import StringIO
 
+import mmap
+import array
 import struct
 import functools
 
@@ -11,9 +14,40 @@ try:
 except ImportError as e:
     from ordereddict import OrderedDict
 
+def get_contents(contents):
+    """ Returns the decodable contents of a string, buffer, mmap, memoryview,
+    or file-like object. Buffers and mmaps are used as they are instead of
+    being read into a new string.
+    """
+    if isinstance(contents, (str, buffer, mmap.mmap)):
+        return contents
+    elif isinstance(contents, memoryview):
+        # Python 2 memoryviews don't slice into strings
+        return contents.tobytes()
+    elif hasattr(contents, 'read'):
+        return contents.read()
+    else:
+        return contents
+
+
+def realign_bytes(prev, data, lo_mask, hi_mask):
+    """ Returns a byte string that joins the high bits of each byte in ``prev``
+    with the low bits of the byte at the same position in ``data``. This is
+    done for the whole span at once by converting both strings to integers
+    so no Python code runs per byte.
+    """
+    count = len(data)
+    if count == 0:
+        return ''
+
+    masks = int('01'*count, 16)
+    result = (int(hexlify(prev), 16) & hi_mask*masks) | (int(hexlify(data), 16) & lo_mask*masks)
+    return unhexlify('%0*x' % (count*2, result))
+
+
 class ByteDecoder(object):
     """
-    :param contents: The string or file-like object to decode
+    :param contents: The string, buffer, mmap, or file-like object to decode
     :param endian: Either > or <. Indicates the endian the bytes are stored in.
 
     Used to unpack parse byte aligned files.
@@ -30,14 +64,11 @@ class ByteDecoder(object):
     _contents = ""
 
     def __init__(self, contents, endian):
-        """ Accepts both strings and files implementing ``read()`` and
-        decodes them in the specified endian format.
+        """ Accepts strings, buffers, mmaps, and files implementing ``read()``
+        and decodes them in the specified endian format. Buffers and mmaps are
+        decoded in place without being copied.
         """
-        if hasattr(contents,'read'):
-            self._contents = contents.read()
-        else:
-            self._contents = contents
-
+        self._contents = get_contents(contents)
         self._buffer = StringIO(self._contents)
         self.length = len(self._contents)
 
@@ -96,7 +127,7 @@ class ByteDecoder(object):
 
 class BitPackedDecoder(object):
     """
-    :param contents: The string of file-like object to decode
+    :param contents: The string, buffer, mmap, or file-like object to decode
 
     Extends :class:`ByteDecoder`. Always packed BIG_ENDIAN
 
@@ -128,6 +159,10 @@ class BitPackedDecoder(object):
     #: joining bytes when we are not byte aligned.
     _bit_masks = zip(_lo_masks, _hi_masks)
 
+    #: Unaligned byte strings at least this long are joined with
+    #: :func:`realign_bytes` instead of one byte at a time.
+    _realign_threshold = 8
+
     def __init__(self, contents):
         self._buffer = ByteDecoder(contents, endian='BIG')
 
@@ -150,6 +185,11 @@ class BitPackedDecoder(object):
         self._next_byte = None
         self._bit_shift = 0
 
+    def seek(self, position):
+        """ Moves cursor to the beginning of the byte at ``position`` """
+        self._buffer.seek(position)
+        self.byte_align()
+
     def read_uint8(self):
         """ Returns the next 8 bits as an unsigned integer """
         data = self._buffer.read_uint8()
@@ -226,7 +266,13 @@ class BitPackedDecoder(object):
         """ Returns the next ``count*8`` bits as a byte string """
         data = self._buffer.read_bytes(count)
 
-        if self._bit_shift != 0:
+        if self._bit_shift != 0 and count >= self._realign_threshold:
+            lo_mask, hi_mask = self._bit_masks[self._bit_shift]
+            prev_bytes = chr(self._next_byte) + data[:-1]
+            self._next_byte = ord(data[-1])
+            data = realign_bytes(prev_bytes, data, lo_mask, hi_mask)
+
+        elif self._bit_shift != 0:
             temp_buffer = StringIO()
             prev_byte = self._next_byte
             lo_mask, hi_mask = self._bit_masks[self._bit_shift]
@@ -342,7 +388,7 @@ class BitPackedDecoder(object):
             data = self.read_bytes(4) #self.read_uint32()
 
         elif datatype == 0x08: # u64
-            data = self.read_unit64()
+            data = self.read_uint64()
 
         elif datatype == 0x09: # vint
             data = self.read_vint()
@@ -351,3 +397,610 @@ class BitPackedDecoder(object):
             raise TypeError("Unknown Data Structure: '%s'" % datatype)
 
         return data
+
+    def read_scalars(self, count):
+        """ Reads up to ``count`` vint and u8 elements of a serialized array.
+        Stops in front of the first element of any other type. Returns the
+        list of values read.
+        """
+        self.byte_align()
+        read_uint8 = self._buffer.read_uint8
+        values = list()
+        for i in xrange(count):
+            datatype = read_uint8()
+            if datatype == 0x09:
+                values.append(self.read_vint())
+            elif datatype == 0x06:
+                values.append(read_uint8())
+            else:
+                # Leave the type identifier for the next read
+                self._buffer.seek(-1, 1)
+                break
+        return values
+
+    def skip_bytes(self, count):
+        """ Moves the cursor past the next ``count*8`` bits """
+        if count <= 0:
+            return
+
+        if self._bit_shift == 0:
+            self._buffer.seek(count, 1)
+        else:
+            # Keep the last byte around for its unused bits
+            self._buffer.seek(count-1, 1)
+            self._next_byte = self._buffer.read_uint8()
+
+    def skip_bits(self, count):
+        """ Moves the cursor past the next ``count`` bits """
+        if count > 0:
+            self.skip_bytes(count >> 3)
+            count &= 7
+        self.read_bits(count)
+
+    def skip_struct(self, datatype=None):
+        """ Moves the cursor past the next nested data structure without
+        decoding it. Only the type identifiers and length prefixes are read.
+        If the type is not specified the first byte is used as the type
+        identifier.
+        """
+        self.byte_align()
+        datatype = self.read_uint8() if datatype == None else datatype
+
+        if datatype == 0x00: # array
+            for i in xrange(self.read_vint()):
+                self.skip_struct()
+
+        elif datatype == 0x01: # bitarray
+            self.skip_bits(self.read_vint())
+            self.byte_align()
+
+        elif datatype == 0x02: # blob
+            self.skip_bytes(self.read_vint())
+
+        elif datatype == 0x03: # choice
+            self.read_vint()
+            self.skip_struct()
+
+        elif datatype == 0x04: # optional
+            if self.read_uint8() != 0:
+                self.skip_struct()
+
+        elif datatype == 0x05: # Struct
+            for i in xrange(self.read_vint()):
+                self.read_vint()
+                self.skip_struct()
+
+        elif datatype == 0x06: # u8
+            self.skip_bytes(1)
+
+        elif datatype == 0x07: # u32
+            self.skip_bytes(4)
+
+        elif datatype == 0x08: # u64
+            self.skip_bytes(8)
+
+        elif datatype == 0x09: # vint
+            self.read_vint()
+
+        else:
+            raise TypeError("Unknown Data Structure: '%s'" % datatype)
+
+    def read_schema(self, schema=None):
+        """ Reads a nested data structure with the layout described by ``schema``.
+        See :func:`compile_schema` for details.
+        """
+        self.byte_align()
+        return compile_schema(schema)(self)
+
+
+class Array(object):
+    """
+    :param element: The schema for each element in the array
+    :param typecode: The :mod:`array` typecode for arrays of plain integers
+
+    Describes a serialized array for :func:`compile_schema`. Arrays are
+    decoded into lists.
+
+    When a typecode is given, arrays made up entirely of vints and u8s are
+    read in one batch with :meth:`BitPackedDecoder.read_scalars` and decoded
+    into an ``array.array`` of that type instead. Arrays with other values,
+    or values that don't fit the typecode, are still decoded into lists.
+    """
+    __slots__ = ('element', 'typecode')
+
+    def __init__(self, element=None, typecode=None):
+        self.element = element
+        self.typecode = typecode
+
+    def __eq__(self, other):
+        return type(other) == Array and (other.element, other.typecode) == (self.element, self.typecode)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((Array, self.element, self.typecode))
+
+    def __repr__(self):
+        if self.typecode is None:
+            return "Array({0!r})".format(self.element)
+        return "Array({0!r}, {1!r})".format(self.element, self.typecode)
+
+
+class Struct(object):
+    """
+    :param record: The type the struct is decoded into
+    :param fields: A dictionary mapping struct keys to the schema for their values
+
+    Describes a serialized struct for :func:`compile_schema`. Keys without a
+    listed schema are decoded just like :meth:`BitPackedDecoder.read_struct`
+    would decode them.
+
+    When the record is ``None`` the struct is decoded into an OrderedDict of
+    its keys and values. Otherwise the values are sorted by key and passed
+    to the record in order, e.g. a namedtuple. When the record is ``tuple``
+    the struct is decoded into a tuple that can be indexed by key. Gaps in
+    the keys are filled with None.
+    """
+    __slots__ = ('record', 'fields', '_key')
+
+    def __init__(self, record=tuple, fields=None):
+        self.record = record
+        self.fields = dict(fields or dict())
+        self._key = (Struct, record, tuple(sorted(self.fields.items())))
+
+    def __eq__(self, other):
+        return type(other) == Struct and other._key == self._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return "Struct({0!r}, {1!r})".format(self.record, self.fields)
+
+
+class Skip(object):
+    """
+    Describes a value that :func:`compile_schema` should skip over with
+    :meth:`BitPackedDecoder.skip_struct` instead of decoding. Skipped values
+    are decoded as ``None``. Use the :data:`SKIP` instance.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(other) == Skip
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(Skip)
+
+    def __repr__(self):
+        return "SKIP"
+
+#: Schema for values that aren't needed
+SKIP = Skip()
+
+
+#: Compiled decode functions by schema
+_compiled_schemas = dict()
+
+
+def compile_schema(schema=None):
+    """ Returns a function that decodes a value with the layout described
+    by ``schema`` from a byte aligned :class:`BitPackedDecoder`. The
+    compiled functions are cached by schema so the same layout is only
+    compiled once.
+
+    The schema can be an :class:`Array`, a :class:`Struct`, :data:`SKIP`, or
+    ``None`` to decode any value the same way
+    :meth:`BitPackedDecoder.read_struct` does.
+    Choices and optionals are transparent; the schema applies to the value
+    they hold. When the serialized data doesn't match the schema it is
+    decoded as if no schema was given.
+    """
+    try:
+        return _compiled_schemas[schema]
+    except KeyError:
+        pass
+
+    if isinstance(schema, Skip):
+        def skip_value(decoder):
+            decoder.skip_struct()
+        _compiled_schemas[schema] = skip_value
+        return skip_value
+
+    def read_value(decoder):
+        datatype = decoder.read_uint8()
+        try:
+            reader = readers[datatype]
+        except IndexError:
+            raise TypeError("Unknown Data Structure: '%s'" % datatype)
+        return reader(decoder)
+
+    def read_bitarray(decoder):
+        data = decoder.read_bits(decoder.read_vint())
+        decoder.byte_align()
+        return data
+
+    def read_choice(decoder):
+        decoder.read_vint()
+        return read_value(decoder)
+
+    def read_optional(decoder):
+        return read_value(decoder) if decoder.read_uint8() != 0 else None
+
+    readers = [
+        None, # array
+        read_bitarray,
+        lambda decoder: decoder.read_bytes(decoder.read_vint()),
+        read_choice,
+        read_optional,
+        None, # struct
+        lambda decoder: decoder.read_uint8(),
+        lambda decoder: decoder.read_bytes(4),
+        lambda decoder: decoder.read_uint64(),
+        lambda decoder: decoder.read_vint(),
+    ]
+
+    read_any = read_value if schema is None else compile_schema(None)
+
+    if isinstance(schema, Array):
+        read_element = compile_schema(schema.element)
+        typecode = schema.typecode
+    else:
+        read_element = read_any
+        typecode = None
+
+    def read_array(decoder):
+        return [read_element(decoder) for i in xrange(decoder.read_vint())]
+
+    def read_typed_array(decoder):
+        count = decoder.read_vint()
+        values = decoder.read_scalars(count)
+        if len(values) == count:
+            try:
+                return array.array(typecode, values)
+            except OverflowError:
+                return values
+
+        values.extend(read_element(decoder) for i in xrange(count - len(values)))
+        return values
+
+    if isinstance(schema, Struct):
+        fields = dict((key, compile_schema(value)) for key, value in schema.fields.items())
+        record = schema.record
+    else:
+        fields = dict()
+        record = None
+
+    def read_dict(decoder):
+        data = OrderedDict()
+        for i in xrange(decoder.read_vint()):
+            key = decoder.read_vint()
+            data[key] = fields.get(key, read_any)(decoder)
+        return data
+
+    def read_struct(decoder):
+        keys = list()
+        values = list()
+        for i in xrange(decoder.read_vint()):
+            key = decoder.read_vint()
+            keys.append(key)
+            values.append(fields.get(key, read_any)(decoder))
+
+        if keys != sorted(keys):
+            keys, values = zip(*sorted(zip(keys, values)))
+
+        if record is tuple:
+            if keys and keys[-1] != len(keys)-1:
+                padded = [None]*(keys[-1]+1)
+                for key, value in zip(keys, values):
+                    padded[key] = value
+                return tuple(padded)
+            return tuple(values)
+
+        return record(*values)
+
+    readers[0] = read_array if typecode is None else read_typed_array
+    readers[5] = read_dict if record is None else read_struct
+    _compiled_schemas[schema] = read_value
+    return read_value
+
+
+class FastBitPackedDecoder(BitPackedDecoder):
+    """
+    :param contents: The string, buffer, mmap, or file-like object to decode
+
+    Extends :class:`BitPackedDecoder`. Decodes exactly the same values.
+
+    Instead of going back to a StringIO for every byte and tracking the
+    partially used byte separately, the contents are loaded into a single
+    bytearray up front and the decoder state is reduced to one integer, the
+    bit position of the cursor. Each read costs a handful of integer ops on
+    the bytes it touches and no additional method calls.
+
+    Select it for a resource with the ``decoder='fast'`` option.
+    """
+
+    def __init__(self, contents):
+        contents = get_contents(contents)
+
+        self._contents = contents
+        self._data = bytearray(contents)
+        self.length = len(contents)
+
+        # The number of bits consumed so far
+        self._pos = 0
+
+    @property
+    def _bit_shift(self):
+        """ The number of bits already used from the current byte """
+        return self._pos & 7
+
+    def tell(self):
+        """ Returns the number of bytes that have been at least partially read """
+        return (self._pos + 7) >> 3
+
+    def peek(self, count):
+        """ Returns the raw byte string for the next ``count`` bytes """
+        start = self.tell()
+        return self._contents[start:start+count]
+
+    def read_range(self, start, end):
+        """ Returns the raw byte string from the indicated address range """
+        return self._contents[start:end]
+
+    def done(self):
+        """ Returns true when all bits in the buffer have been used"""
+        return self._pos >= self.length*8
+
+    def byte_align(self):
+        """ Moves cursor to the beginning of the next byte """
+        self._pos = (self._pos + 7) & ~7
+
+    def seek(self, position):
+        """ Moves cursor to the beginning of the byte at ``position`` """
+        self._pos = position << 3
+
+    def read_bits(self, count):
+        """ Returns the next ``count`` bits as an unsigned integer """
+        pos = self._pos
+        data = self._data
+        index = pos >> 3
+        bit_shift = pos & 7
+        self._pos = pos + count
+
+        # Use up the byte in progress first
+        if bit_shift:
+            bits_left = 8 - bit_shift
+            if count <= bits_left:
+                return (data[index] >> bit_shift) & self._lo_masks[count]
+            result = data[index] >> bit_shift
+            count -= bits_left
+            index += 1
+        else:
+            result = 0
+
+        # Then any whole bytes, finishing with the low bits of the next byte
+        while count >= 8:
+            result = result << 8 | data[index]
+            index += 1
+            count -= 8
+        if count > 0:
+            result = result << count | data[index] & self._lo_masks[count]
+        elif count < 0:
+            # Some files have negative bitarray lengths. Use the next byte
+            # the same way the original decoder does.
+            self._pos = (index + 1) << 3
+            result = data[index] & self._lo_masks[count]
+        return result
+
+    def read_bool(self):
+        """ Returns the next bit as an integer """
+        pos = self._pos
+        self._pos = pos + 1
+        return (self._data[pos >> 3] >> (pos & 7)) & 1
+
+    def read_uint8(self):
+        """ Returns the next 8 bits as an unsigned integer """
+        pos = self._pos
+        if pos & 7:
+            return self.read_bits(8)
+        self._pos = pos + 8
+        return self._data[pos >> 3]
+
+    def read_uint16(self):
+        """ Returns the next 16 bits as an unsigned integer """
+        return self.read_bits(16)
+
+    def read_uint32(self):
+        """ Returns the next 32 bits as an unsigned integer """
+        return self.read_bits(32)
+
+    def read_uint64(self):
+        """ Returns the next 64 bits as an unsigned integer """
+        return self.read_bits(64)
+
+    def read_vint(self):
+        """ Reads a signed integer of variable length """
+        if self._pos & 7:
+            return super(FastBitPackedDecoder, self).read_vint()
+
+        data = self._data
+        index = self._pos >> 3
+        byte = data[index]
+        negative = byte & 0x01
+        result = (byte & 0x7F) >> 1
+        bits = 6
+        while byte & 0x80:
+            index += 1
+            byte = data[index]
+            result |= (byte & 0x7F) << bits
+            bits += 7
+        self._pos = (index + 1) << 3
+        return -result if negative else result
+
+    def read_aligned_bytes(self, count):
+        """ Skips to the beginning of the next byte and returns the next ``count`` bytes as a byte string """
+        start = (self._pos + 7) >> 3
+        self._pos = (start + count) << 3
+        return self._contents[start:start+count]
+
+    def read_bytes(self, count):
+        """ Returns the next ``count*8`` bits as a byte string """
+        bit_shift = self._pos & 7
+        if bit_shift == 0:
+            return self.read_aligned_bytes(count)
+
+        # Each byte joins the unused high bits of the byte in progress
+        # with the low bits of the byte after it.
+        start = self._pos >> 3
+        self._pos += count*8
+        lo_mask, hi_mask = self._bit_masks[bit_shift]
+        if count >= self._realign_threshold:
+            contents = self._contents
+            return realign_bytes(contents[start:start+count], contents[start+1:start+count+1], lo_mask, hi_mask)
+
+        data = self._data
+        return str(bytearray(data[i] & hi_mask | data[i+1] & lo_mask for i in xrange(start, start+count)))
+
+    def read_scalars(self, count):
+        """ Reads up to ``count`` vint and u8 elements of a serialized array.
+        Stops in front of the first element of any other type. Returns the
+        list of values read.
+        """
+        data = self._data
+        index = (self._pos + 7) >> 3
+        values = list()
+        append = values.append
+        for i in xrange(count):
+            datatype = data[index]
+            if datatype == 0x09:
+                byte = data[index+1]
+                negative = byte & 0x01
+                result = (byte & 0x7F) >> 1
+                bits = 6
+                index += 2
+                while byte & 0x80:
+                    byte = data[index]
+                    result |= (byte & 0x7F) << bits
+                    bits += 7
+                    index += 1
+                append(-result if negative else result)
+            elif datatype == 0x06:
+                append(data[index+1])
+                index += 2
+            else:
+                break
+        self._pos = index << 3
+        return values
+
+    def skip_bytes(self, count):
+        """ Moves the cursor past the next ``count*8`` bits """
+        if count > 0:
+            self._pos += count*8
+
+    def skip_bits(self, count):
+        """ Moves the cursor past the next ``count`` bits """
+        if count >= 0:
+            self._pos += count
+        else:
+            self.read_bits(count)
+
+    def skip_struct(self, datatype=None):
+        """ Moves the cursor past the next nested data structure without
+        decoding it. The length prefixes are walked directly in the
+        bytearray without any method calls.
+        """
+        index = _skip_value(self._data, (self._pos + 7) >> 3, datatype)
+        self._pos = index << 3
+
+
+def _read_vint_at(data, index):
+    """ Returns the vint starting at ``index`` of a bytearray and the index after it """
+    byte = data[index]
+    negative = byte & 0x01
+    result = (byte & 0x7F) >> 1
+    bits = 6
+    while byte & 0x80:
+        index += 1
+        byte = data[index]
+        result |= (byte & 0x7F) << bits
+        bits += 7
+    return (-result if negative else result), index + 1
+
+
+def _skip_value(data, index, datatype=None):
+    """ Returns the index just past the nested data structure starting at
+    ``index`` of a bytearray. Nested values are always byte aligned.
+    """
+    if datatype is None:
+        datatype = data[index]
+        index += 1
+
+    if datatype == 0x09: # vint
+        while data[index] & 0x80:
+            index += 1
+        return index + 1
+
+    elif datatype == 0x05: # Struct
+        entries, index = _read_vint_at(data, index)
+        for i in xrange(entries):
+            while data[index] & 0x80:
+                index += 1
+            index = _skip_value(data, index + 1)
+        return index
+
+    elif datatype == 0x00: # array
+        entries, index = _read_vint_at(data, index)
+        for i in xrange(entries):
+            index = _skip_value(data, index)
+        return index
+
+    elif datatype == 0x06: # u8
+        return index + 1
+
+    elif datatype == 0x07: # u32
+        return index + 4
+
+    elif datatype == 0x08: # u64
+        return index + 8
+
+    elif datatype == 0x02: # blob
+        length, index = _read_vint_at(data, index)
+        return index + max(length, 0)
+
+    elif datatype == 0x01: # bitarray, negative lengths still use a byte
+        length, index = _read_vint_at(data, index)
+        return index + ((length + 7) >> 3 if length >= 0 else 1)
+
+    elif datatype == 0x03: # choice
+        while data[index] & 0x80:
+            index += 1
+        return _skip_value(data, index + 1)
+
+    elif datatype == 0x04: # optional
+        return _skip_value(data, index + 1) if data[index] else index + 1
+
+    else:
+        raise TypeError("Unknown Data Structure: '%s'" % datatype)
+
+
+#: The bit packed decoder implementations selectable with the ``decoder`` option
+BIT_DECODERS = dict(
+    default=BitPackedDecoder,
+    fast=FastBitPackedDecoder,
+)
+
+
+def get_bit_decoder(name):
+    """ Returns the bit packed decoder class registered under ``name`` """
+    try:
+        return BIT_DECODERS[name]
+    except KeyError:
+        raise ValueError("Unknown decoder '{0}', expected one of: {1}".format(name, ', '.join(sorted(BIT_DECODERS))))
@@ -265,7 +265,9 @@ class SelectionEvent(GameEvent):
         #: The type of mask to apply. One of None, Mask, OneIndices, ZeroIndices
         self.mask_type = data['remove_mask'][0]
 
-        #: The data for the mask
+        #: The data for the mask. For Mask, a (bit_mask, mask_length) tuple
+        #: where bit i is set if the unit at index i is removed. Use
+        #: :func:`~sc2reader.utils.iter_bits` to walk through the bits.
         self.mask_data = data['remove_mask'][1]
 
         #: The unit type data for the new units
@@ -350,7 +352,9 @@ class HotkeyEvent(GameEvent):
         #: The type of mask to apply. One of None, Mask, OneIndices, ZeroIndices
         self.mask_type = data['remove_mask'][0]
 
-        #: The data for the mask
+        #: The data for the mask. For Mask, a (bit_mask, mask_length) tuple
+        #: where bit i is set if the unit at index i is removed. Use
+        #: :func:`~sc2reader.utils.iter_bits` to walk through the bits.
         self.mask_data = data['remove_mask'][1]
 
 class SetToHotkeyEvent(HotkeyEvent):
@@ -3,16 +3,21 @@ from __future__ import absolute_import
 
 import os
 import re
+import mmap
+import zlib
+import hashlib
+import tempfile
+import cPickle
 
-import urllib2
 from cStringIO import StringIO
 
 from collections import defaultdict
 
-import urlparse, time
+import time
+import sc2reader
 from sc2reader import utils
 from sc2reader import log_utils
-from sc2reader.resources import Resource, Replay, Map, GameSummary, MapInfo, MapHeader, Localization
+from sc2reader.resources import Resource, Replay, Map, GameSummary, MapInfo, MapHeader, Localization, peek_replay, hash_file
 
 @log_utils.loggable
 class SC2Factory(object):
@@ -23,6 +28,7 @@ class SC2Factory(object):
 
         * :meth:`load_replay` - :class:`Replay`
         * :meth:`load_replays` - generator<:class:`Replay`>
+        * :meth:`peek_replay` - :class:`~sc2reader.utils.AttributeDict`
         * :meth:`load_map` - :class:`Map`
         * :meth:`load_maps` - : generator<:class:`Map`>
 
@@ -43,8 +49,8 @@ class SC2Factory(object):
     _resource_name_map = dict(replay=Replay,map=Map)
 
     default_options = {
-        Resource: {'debug':False},
-        Replay: {'load_level':4, 'load_map':False},
+        Resource: {'debug':False, 'mmap':True, 'hash_algorithm':'sha256'},
+        Replay: {'load_level':4, 'load_map':False, 'lazy_events':False, 'event_types':None, 'tracker_event_types':None, 'message_event_types':None, 'min_frame':None, 'max_frame':None, 'lean':False},
     }
 
     def __init__(self, **options):
@@ -68,6 +74,16 @@ class SC2Factory(object):
         """Loads a collection of sc2replay files, returns a generator."""
         return self.load_all(Replay, sources, options, extension='SC2Replay', **new_options)
 
+    def peek_replay(self, source, options=None, **new_options):
+        """Reads the versions and length of a sc2replay file from just its header.
+        Accepts a file path or file object. See :func:`~sc2reader.resources.peek_replay`."""
+        options = options or self._get_options(Replay, **new_options)
+        if isinstance(source, basestring):
+            location = os.path.join(options.get('directory',''), source)
+            with open(location, 'rb') as replay_file:
+                return peek_replay(replay_file)
+        return peek_replay(source)
+
     def load_localization(self, source, options=None, **new_options):
         """Loads a single s2ml file. Accepts file path, url, or file object."""
         return self.load(Localization, source, options, **new_options)
@@ -130,18 +146,26 @@ class SC2Factory(object):
     # Support Functions
     def load(self, cls, source, options=None, **new_options):
         options = options or self._get_options(cls, **new_options)
-        resource, filename = self._load_resource(source, options=options)
-        return self._load(cls, resource, filename=filename, options=options)
+        resource, filename, mapped_path = self._load_resource(source, options=options)
+        return self._load(cls, resource, filename=filename, options=self._get_file_options(options, mapped_path))
 
     def load_all(self, cls, sources, options=None, **new_options):
         options = options or self._get_options(cls, **new_options)
-        for resource, filename in self._load_resources(sources, options=options):
-            yield self._load(cls, resource, filename=filename, options=options)
+        for resource, filename, mapped_path in self._load_resources(sources, options=options):
+            yield self._load(cls, resource, filename=filename, options=self._get_file_options(options, mapped_path))
 
 
     # Internal Functions
+    def _get_file_options(self, options, mapped_path):
+        # Resources close the memory maps the factory opened for them once they
+        # are loaded and map the file at the mapped_path again if they need it.
+        # Files passed in are left open. The mapped_path is always set so that
+        # it isn't inherited from the options of another resource.
+        return utils.merged_dict(options, dict(mapped_path=mapped_path))
+
     def _load(self, cls, resource, filename, options):
         obj = cls(resource, filename=filename, factory=self, **options)
+        obj._close_file()
         for plugin in options.get('plugins',self._get_plugins(cls)):
             obj = plugin(obj)
         return obj
@@ -173,21 +197,33 @@ class SC2Factory(object):
             yield self._load_resource(resource, options=options)
 
     def load_remote_resource_contents(self, resource, **options):
+        # urllib2 is slow to import and only needed for remote resources
+        import urllib2
+
         self.logger.info("Fetching remote resource: "+resource)
         return urllib2.urlopen(resource).read()
 
     def load_local_resource_contents(self, location, **options):
         # Extract the contents so we can close the file
         with open(location, 'rb') as resource_file:
+            if options.get('mmap', False):
+                # A read only map shares the OS page cache instead of copying the
+                # file into memory. Empty files and some devices can't be mapped.
+                try:
+                    return mmap.mmap(resource_file.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, EnvironmentError) as e:
+                    self.logger.debug("Unable to mmap {0}: {1}".format(location, e))
             return resource_file.read()
 
     def _load_resource(self, resource, options=None, **new_options):
-        """http links, filesystem locations, and file-like objects"""
+        """http links, filesystem locations, and file-like objects. Returns the
+        resource, its name, and the path of the file if the factory mapped it."""
         options = options or self._get_options(Resource, **new_options)
 
         if isinstance(resource, utils.DepotFile):
             resource = resource.url
 
+        mapped_path = None
         if isinstance(resource, basestring):
             if re.match(r'https?://',resource):
                 contents = self.load_remote_resource_contents(resource, **options)
@@ -196,10 +232,13 @@ class SC2Factory(object):
                 directory = options.get('directory','')
                 location = os.path.join(directory, resource)
                 contents = self.load_local_resource_contents(location, **options)
+                if isinstance(contents, mmap.mmap):
+                    mapped_path = os.path.abspath(location)
 
-            # StringIO implements a fuller file-like object
+            # StringIO implements a fuller file-like object. Memory maps
+            # already do and can be decoded without being copied.
             resource_name = resource
-            resource = StringIO(contents)
+            resource = contents if isinstance(contents, mmap.mmap) else StringIO(contents)
 
         else:
             # Totally not designed for large files!!
@@ -212,11 +251,13 @@ class SC2Factory(object):
         if options.get('verbose', None):
             print resource_name
 
-        return (resource, resource_name)
+        return (resource, resource_name, mapped_path)
 
 class CachedSC2Factory(SC2Factory):
 
     def get_remote_cache_key(self, remote_resource):
+        import urlparse
+
         # Strip the port and use the domain as the bucket
         # and use the full path as the key
         parseresult = urlparse.urlparse(remote_resource)
@@ -333,3 +374,184 @@ class DoubleCachedSC2Factory(DictCachedSC2Factory, FileCachedSC2Factory):
 
         DictCachedSC2Factory.cache_set(self, cache_key, resource)
         return resource
+
+
+class ParsedReplayData(object):
+    """
+    :param blobs: A dict of pickled raw data by data file
+
+    Holds the raw data of a replay pickled by data file. Used as the replay's
+    ``data_cache`` option to record the raw data as it is decoded and to hand
+    cached raw data back to the replay instead of decoding it again.
+    """
+    def __init__(self, blobs=None):
+        self.blobs = blobs or dict()
+
+    def __contains__(self, data_file):
+        return data_file in self.blobs
+
+    def __getitem__(self, data_file):
+        return cPickle.loads(self.blobs[data_file])
+
+    def __setitem__(self, data_file, value):
+        self.blobs[data_file] = cPickle.dumps(value, 2)
+
+
+class ParsedCacheSC2Factory(SC2Factory):
+    """
+    :param cache_dir: Local directory to cache parsed replays in.
+    :param cache_max_size: The max number of bytes to keep in the cache.
+
+    Extends :class:`SC2Factory`.
+
+    Caches the decoded raw data of replays on the file system so that loading
+    the same replay again skips opening the MPQ archive and bit decoding. The
+    replay context and plugins are still run on every load.
+
+    Entries are pickled, and unpickling can run arbitrary code, so the
+    ``cache_dir`` must only be writable by users you trust. A warning is
+    logged when other users can write to it.
+
+    Entries are keyed by the sha256 hash of the replay file, the sc2reader version, the
+    ``cache_format``, and the options that change the raw data. They are written to a temporary
+    file and renamed into place so several processes can share a cache.
+    When ``cache_max_size`` is set the least recently used entries are
+    evicted once the cache grows past it, down to ``cache_evict_ratio`` of
+    the max size. The cache size is tracked as entries are written and the
+    cache directory is only scanned when it may have grown too large, so
+    entries written by other processes are counted at the next scan. Lazy
+    game events aren't cached.
+    """
+
+    #: The options that change the decoded raw data of a replay
+    cache_options = ['load_level', 'decoder', 'debug', 'event_types', 'tracker_event_types', 'message_event_types', 'min_frame', 'max_frame']
+
+    #: The version of the cached raw data. Bump this whenever the raw data
+    #: returned by the readers changes so that older entries aren't used.
+    cache_format = 1
+
+    #: The hash of the replay file that entries are keyed by, whatever the
+    #: ``hash_algorithm`` option is
+    cache_hash_algorithm = 'sha256'
+
+    #: The fraction of the ``cache_max_size`` the cache is evicted down to
+    cache_evict_ratio = 0.9
+
+    def __init__(self, cache_dir, cache_max_size=0, **options):
+        super(ParsedCacheSC2Factory, self).__init__(**options)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.cache_max_size = int(cache_max_size)
+        if not os.path.isdir(self.cache_dir):
+            raise ValueError("cache_dir ({0}) must be an existing directory.".format(self.cache_dir))
+        elif not os.access(self.cache_dir, os.F_OK | os.W_OK | os.R_OK ):
+            raise ValueError("Must have read/write access to {0} for parsed replay caching.".format(self.cache_dir))
+
+        # Anyone who can write to the cache can make replay loads run their code
+        if os.stat(self.cache_dir).st_mode & 0o002:
+            self.logger.warn("Parsed replay cache {0} is writable by other users; cache entries are unpickled and must be trusted.".format(self.cache_dir))
+
+        # The bytes in the cache, unknown until the first eviction scan
+        self._cache_size = None
+
+    def _load(self, cls, resource, filename, options):
+        if not issubclass(cls, Replay) or options.get('lazy_events', False):
+            return super(ParsedCacheSC2Factory, self)._load(cls, resource, filename, options)
+
+        # Entries are always keyed by a strong digest since a collision
+        # between 32 bit checksums would load the raw data of another replay
+        filehash = hash_file(resource, self.cache_hash_algorithm)
+        cache_key = self.get_parsed_cache_key(filehash, options)
+
+        data_cache = self.parsed_cache_get(cache_key)
+        cache_hit = data_cache is not None
+        if not cache_hit:
+            data_cache = ParsedReplayData()
+
+        replay = super(ParsedCacheSC2Factory, self)._load(cls, resource, filename, utils.merged_dict(options, dict(data_cache=data_cache)))
+        replay.opt.pop('data_cache', None)
+        if replay.hash_algorithm == self.cache_hash_algorithm:
+            replay.filehash = filehash
+        if not cache_hit:
+            self.parsed_cache_set(cache_key, data_cache)
+        return replay
+
+    def get_parsed_cache_key(self, filehash, options):
+        key_options = [(name, options.get(name)) for name in self.cache_options]
+        key_source = repr((filehash, sc2reader.__version__, self.cache_format, key_options))
+        return hashlib.sha1(key_source).hexdigest()
+
+    def parsed_cache_path(self, cache_key):
+        return os.path.join(self.cache_dir, cache_key[:2], cache_key)
+
+    def parsed_cache_get(self, cache_key):
+        """ Returns the cached :class:`ParsedReplayData` or None on a miss. """
+        cache_path = self.parsed_cache_path(cache_key)
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                blobs = cPickle.loads(zlib.decompress(cache_file.read()))
+            os.utime(cache_path, None)
+        except (EnvironmentError, zlib.error, cPickle.UnpicklingError, EOFError, ValueError):
+            # Missing or evicted by another process
+            return None
+        return ParsedReplayData(blobs)
+
+    def parsed_cache_set(self, cache_key, data_cache):
+        cache_path = self.parsed_cache_path(cache_key)
+        bucket_dir = os.path.dirname(cache_path)
+        if not os.path.isdir(bucket_dir):
+            try:
+                os.makedirs(bucket_dir)
+            except OSError:
+                # Another process may have made it first
+                if not os.path.isdir(bucket_dir):
+                    raise
+
+        # Write to a temporary file and rename it into place so that other
+        # processes never read a partially written entry.
+        entry = zlib.compress(cPickle.dumps(data_cache.blobs, 2), 1)
+        fd, temp_path = tempfile.mkstemp(dir=bucket_dir, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(entry)
+            os.rename(temp_path, cache_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+        if self.cache_max_size:
+            if self._cache_size is not None:
+                self._cache_size += len(entry)
+            if self._cache_size is None or self._cache_size > self.cache_max_size:
+                self.evict_parsed_cache()
+
+    def evict_parsed_cache(self):
+        """ Scans the cache and removes the least recently used entries until
+        the cache is no larger than ``cache_evict_ratio`` of the
+        ``cache_max_size``.
+        """
+        entries = list()
+        for bucket in os.listdir(self.cache_dir):
+            bucket_dir = os.path.join(self.cache_dir, bucket)
+            if not os.path.isdir(bucket_dir):
+                continue
+            for name in os.listdir(bucket_dir):
+                if name.startswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(bucket_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(bucket_dir, name)))
+
+        cache_size = sum(size for mtime, size, path in entries)
+        if cache_size > self.cache_max_size:
+            evict_size = int(self.cache_max_size * self.cache_evict_ratio)
+            for mtime, size, path in sorted(entries):
+                if cache_size <= evict_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # Already evicted by another process
+                cache_size -= size
+        self._cache_size = cache_size
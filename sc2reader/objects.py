@@ -11,6 +11,15 @@ Location = namedtuple('Location',('x','y'))
 MapData = namedtuple('MapData',['gateway','map_hash'])
 ColorData = namedtuple('ColorData',['a','r','g','b'])
 BnetData = namedtuple('BnetData',['gateway','unknown2','subregion','uid'])
+AttributeData = namedtuple('AttributeData',['header','id','player','name','value'])
+
+# The replay.details namedtuples change with the build. Each version gets
+# its own name so that the decoded details can be pickled.
+PlayerData = namedtuple('PlayerData',['name','bnet','race','color','control','team','handicap','observe','result'])
+PlayerData_24764 = namedtuple('PlayerData_24764',['name','bnet','race','color','control','team','handicap','observe','result','working_set_slot'])
+Details = namedtuple('Details',['players','map','difficulty','thumbnail','blizzard_map','file_time','utc_adjustment','unknown4','unknown5','unknown6','dependencies','unknown8','unknown9','unknown10'])
+Details_22612 = namedtuple('Details_22612',['players','map','difficulty','thumbnail','blizzard_map','file_time','utc_adjustment','unknown4','unknown5','unknown6','dependencies','unknown8','unknown9','unknown10','unknown11'])
+Details_Beta = namedtuple('Details_Beta',['players','map','difficulty','thumbnail','blizzard_map','file_time','utc_adjustment','unknown4','unknown5','unknown6','dependencies','unknown8','unknown9','unknown10','unknown11','unknown12'])
 
 class Team(object):
     """
@@ -53,18 +62,38 @@ class Team(object):
         return hashlib.sha256(raw_hash).hexdigest()
 
 
+#: Maps (attr_id, value) pairs to their (name, value) lookups
+_attribute_lookups = dict()
+
+def lookup_attribute(attr_id, value):
+    """
+    :param attr_id: The attribute id code
+    :param value: The raw 4 byte value code
+
+    Returns the attribute name and value for the codes stored in the
+    replay.attributes.events file. Lookups are cached since replays only
+    use a small set of them.
+    """
+    try:
+        return _attribute_lookups[(attr_id, value)]
+    except KeyError:
+        pass
+
+    if attr_id not in LOBBY_PROPERTIES:
+        raise ValueError("Unknown attribute id: {0}".format(attr_id))
+
+    name, lookup = LOBBY_PROPERTIES[attr_id]
+    result = _attribute_lookups[(attr_id, value)] = (name, lookup[value.strip("\x00 ")[::-1]])
+    return result
+
+
 class Attribute(object):
 
     def __init__(self, header, attr_id, player, value):
         self.header = header
         self.id = attr_id
         self.player = player
-
-        if self.id not in LOBBY_PROPERTIES:
-            raise ValueError("Unknown attribute id: "+self.id)
-        else:
-            self.name, lookup = LOBBY_PROPERTIES[self.id]
-            self.value = lookup[value.strip("\x00 ")[::-1]]
+        self.name, self.value = lookup_attribute(attr_id, value)
 
     def __repr__(self):
         return str(self)
@@ -8,8 +8,11 @@ from sc2reader.log_utils import loggable
 
 from functools import wraps
 from bisect import bisect_left
+from itertools import compress
 from collections import defaultdict
 
+from sc2reader.utils import iter_bits
+
 def plugin(func):
     @wraps(func)
     def wrapper(**options):
@@ -87,14 +90,12 @@ class UnitSelection(object):
 
         elif mode == 'Mask':
             """ Deselect objects according to deselect mask """
-            mask = data
-            if len(mask) < size:
-                # pad to the right
-                mask = mask+[False,]*(len(self.objects)-len(mask))
-
-            self.logger.debug("Deselection Mask: {0}".format(mask))
-            self.objects = [ obj for (slct, obj) in filter(lambda (slct, obj): not slct, zip(mask, self.objects)) ]
-            return len(mask) <= size
+            mask, length = data
+            self.logger.debug("Deselection Mask: {0:b}".format(mask))
+
+            # Objects past the end of the mask are kept
+            self.objects = list(compress(self.objects, iter_bits(~mask, size)))
+            return length <= size
 
         elif mode == 'OneIndices':
             """ Deselect objects according to indexes """
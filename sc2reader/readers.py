@@ -2,17 +2,24 @@
 from __future__ import absolute_import
 
 import struct
+import sys
 
+from bisect import bisect_left
+from binascii import hexlify, unhexlify
 from collections import defaultdict
 from itertools import chain
 
+from sc2reader import events
 from sc2reader.exceptions import ParseError, ReadError
 from sc2reader.objects import *
 from sc2reader.events.game import *
 from sc2reader.events.message import *
 from sc2reader.events.tracker import *
 from sc2reader.utils import AttributeDict, DepotFile
-from sc2reader.decoders import BitPackedDecoder, ByteDecoder
+from sc2reader.decoders import ByteDecoder, Array, Struct, compile_schema, get_bit_decoder
+
+#: A replay.attributes.events record: header, attribute id, player, and value
+ATTRIBUTE_STRUCT = struct.Struct('<IIB4s')
 
 class Reader(object):
     def __init__(self, **options):
@@ -21,10 +28,44 @@ class Reader(object):
     def __call__(self, data, replay):
         raise NotImplementedError
 
+    def get_decoder(self, data, replay):
+        """ Wraps ``data`` in the bit packed decoder selected by the replay's ``decoder`` option """
+        return get_bit_decoder(replay.opt.get('decoder', 'default'))(data)
+
+    def get_event_types(self, replay, option):
+        """ Returns a tuple of the event classes named by the replay's ``option``
+        or None if all events should be read. The option holds a list of event
+        classes or their names.
+        """
+        event_types = replay.opt.get(option)
+        if event_types is None:
+            return None
+
+        classes = list()
+        for event_type in event_types:
+            if isinstance(event_type, basestring):
+                if not isinstance(getattr(events, event_type, None), type):
+                    raise ValueError("Unknown event type {0} in {1} option".format(event_type, option))
+                event_type = getattr(events, event_type)
+            classes.append(event_type)
+        return tuple(classes)
+
+    def get_frame_window(self, replay):
+        """ Returns the ``(min_frame, max_frame)`` of the events to read from the
+        replay's ``min_frame`` and ``max_frame`` options. Both are inclusive.
+        Readers skip events before the ``min_frame`` and stop reading once they
+        pass the ``max_frame``.
+        """
+        min_frame = replay.opt.get('min_frame') or 0
+        max_frame = replay.opt.get('max_frame')
+        if max_frame is None:
+            max_frame = sys.maxint
+        return min_frame, max_frame
+
 class InitDataReader_Base(Reader):
 
     def __call__(self, data, replay):
-        data = BitPackedDecoder(data)
+        data = self.get_decoder(data, replay)
 
         init_data = dict( #58
             player_init_data = [dict( #38
@@ -133,7 +174,7 @@ class InitDataReader_Base(Reader):
 class InitDataReader_23260(Reader):
 
     def __call__(self, data, replay):
-        data = BitPackedDecoder(data)
+        data = self.get_decoder(data, replay)
 
         init_data = dict( #58
             player_init_data = [dict( #38
@@ -235,7 +276,7 @@ class InitDataReader_23260(Reader):
 class InitDataReader_24764(InitDataReader_Base):
 
     def __call__(self, data, replay):
-        data = BitPackedDecoder(data)
+        data = self.get_decoder(data, replay)
 
         init_data = dict(
             player_init_data = [dict(
@@ -346,14 +387,24 @@ class AttributesEventsReader_Base(Reader):
         # player id, and a four byte value code. Unlike the other files, this
         # file is stored in little endian format.
         #
-        # See: ``objects.Attribute`` for attribute id and value lookup logic
+        # See: ``objects.lookup_attribute`` for attribute id and value lookup logic
         #
-        data = ByteDecoder(data, endian='LITTLE')
-        attribute_events = list()
+        contents = data
+        data = ByteDecoder(contents, endian='LITTLE')
         data.read_bytes(self.header_length)
-        for attribute in range(data.read_uint32()):
-            info = struct.unpack('<IIB4s', data.read(13))
-            attribute_events.append(Attribute(*info))
+        count = data.read_uint32()
+
+        # Unpack the attribute records in place with the precompiled struct
+        start = data.tell()
+        size = ATTRIBUTE_STRUCT.size
+        unpack_from = ATTRIBUTE_STRUCT.unpack_from
+
+        attribute_events = list()
+        append = attribute_events.append
+        for offset in xrange(start, start+count*size, size):
+            header, attr_id, player, value = unpack_from(contents, offset)
+            name, value = lookup_attribute(attr_id, value)
+            append(AttributeData(header, attr_id, player, name, value))
 
         return attribute_events
 
@@ -364,8 +415,8 @@ class AttributesEventsReader_17326(AttributesEventsReader_Base):
 
 
 class DetailsReader_Base(Reader):
-    PlayerData = namedtuple('PlayerData',['name','bnet','race','color','control','team','handicap','observe','result'])
-    Details = namedtuple('Details',['players','map','difficulty','thumbnail','blizzard_map','file_time','utc_adjustment','unknown4','unknown5','unknown6','dependencies','unknown8','unknown9','unknown10'])
+    PlayerData = PlayerData
+    Details = Details
 
     def __call__(self, data, replay):
         # The entire details file is just a serialized data structure
@@ -414,38 +465,27 @@ class DetailsReader_Base(Reader):
         #   modPaths (optional array)
         #       path string
         #
-        details = BitPackedDecoder(data).read_struct()
-
         # To make things a little more meaningful in the rest of the code we
-        # step through all the gathered data and map it into namedtuples so that
-        # we don't need to use data[0][0][1][3] to get the battle.net player id.
-        # The field names are documented in the namedtuples section of the
-        # objects file. The ordered_values function extracts the values while
-        # maintaining key order required for proper mapping
-        ordered_values = lambda dict: [v for k,v in sorted(dict.iteritems())]
-
-        # Because named tuples are read only, we need to build them in pieces
-        # from the bottom up instead of in place from the top down.
-        players = list()
-        for pdata in details[0]:
-            pdata[1] = BnetData(*ordered_values(pdata[1]))
-            pdata[3] = ColorData(*ordered_values(pdata[3]))
-            player = self.PlayerData(*ordered_values(pdata))
-            players.append(player)
-        details[0] = players
-        details[10] = [DepotFile(bytes) for bytes in details[10]]
-        # As a final touch, label all extracted information using the Details
-        # named tuple from objects.py
-        return self.Details(*ordered_values(details))
+        # decode all the data straight into namedtuples so that we don't need
+        # to use data[0][0][1][3] to get the battle.net player id. The field
+        # names are documented in the namedtuples section of the objects file.
+        # Struct values are passed to the namedtuples in key order.
+        details = self.get_decoder(data, replay).read_schema(Struct(self.Details, {
+            0: Array(Struct(self.PlayerData, {
+                1: Struct(BnetData),
+                3: Struct(ColorData),
+            })),
+        }))
+        return details._replace(dependencies=[DepotFile(bytes) for bytes in details.dependencies])
 
 class DetailsReader_22612(DetailsReader_Base):
-    Details = namedtuple('Details',['players','map','difficulty','thumbnail','blizzard_map','file_time','utc_adjustment','unknown4','unknown5','unknown6','dependencies','unknown8','unknown9','unknown10', 'unknown11'])
+    Details = Details_22612
 
 class DetailsReader_Beta(DetailsReader_Base):
-    Details = namedtuple('Details',['players','map','difficulty','thumbnail','blizzard_map','file_time','utc_adjustment','unknown4','unknown5','unknown6','dependencies','unknown8','unknown9','unknown10', 'unknown11', 'unknown12'])
+    Details = Details_Beta
 
 class DetailsReader_Beta_24764(DetailsReader_Beta):
-    PlayerData = namedtuple('PlayerData',['name','bnet','race','color','control','team','handicap','observe','result','working_set_slot'])
+    PlayerData = PlayerData_24764
 
 class MessageEventsReader_Base(Reader):
     TARGET_BITS=3
@@ -453,26 +493,49 @@ class MessageEventsReader_Base(Reader):
         # The replay.message.events file is a single long list containing three
         # different element types (minimap pings, player messages, and some sort
         # of network packets); each differentiated by flags.
-        data = BitPackedDecoder(data)
+        data = self.get_decoder(data, replay)
         pings = list()
         messages = list()
         packets = list()
 
+        # Excluded message types are skipped over without being constructed
+        event_types = self.get_event_types(replay, 'message_event_types')
+        if event_types is None:
+            event_types = (MessageEvent,)
+        read_pings = issubclass(PingEvent, event_types)
+        read_packets = issubclass(PacketEvent, event_types)
+        read_messages = issubclass(ChatEvent, event_types)
+        min_frame, max_frame = self.get_frame_window(replay)
+
         frame = 0
         while not data.done():
             # All the element types share the same time, pid, flags header.
             frame += data.read_frames()
+            if frame > max_frame:
+                break
+
             pid = data.read_bits(5)
             t = data.read_bits(3)
             flags = data.read_uint8()
+            skip = frame < min_frame
 
             if flags in (0x83,0x89):
+                if skip or not read_pings:
+                    data.skip_bytes(8)
+                    continue
+
                 # We need some tests for this, probably not right
                 x = data.read_uint32()
                 y = data.read_uint32()
                 pings.append(PingEvent(frame, pid, flags, x, y))
 
             elif flags == 0x80:
+                # Packets are read whatever the frame window is since the
+                # recorder is found from them. They are all at frame 0.
+                if not read_packets:
+                    data.skip_bytes(4)
+                    continue
+
                 info = data.read_bytes(4)
                 packets.append(PacketEvent(frame, pid, flags, info))
 
@@ -482,6 +545,10 @@ class MessageEventsReader_Base(Reader):
                 target = flags & lo_mask
                 extension = (flags & hi_mask) << 3
                 length = data.read_uint8()
+                if skip or not read_messages:
+                    data.skip_bytes(length + extension)
+                    continue
+
                 text = data.read_bytes(length + extension)
                 messages.append(ChatEvent(frame, pid, flags, target, text, (flags, lo_mask, hi_mask, length, extension)))
 
@@ -491,8 +558,182 @@ class MessageEventsReader_Beta_24247(MessageEventsReader_Base):
     TARGET_BITS=4
 
 
+class _DataDependent(Exception):
+    pass
+
+
+class _Unknown(object):
+    """ A value read by the :class:`_WidthProbe`. It can be used in arithmetic
+    and stored, but anything that makes a decision based on it raises
+    :class:`_DataDependent`.
+    """
+    def _unknown(self, *args):
+        return self
+
+    def _decide(self, *args):
+        raise _DataDependent()
+
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _unknown
+    __div__ = __rdiv__ = __floordiv__ = __rfloordiv__ = __mod__ = __rmod__ = _unknown
+    __lshift__ = __rlshift__ = __rshift__ = __rrshift__ = __neg__ = __invert__ = _unknown
+    __and__ = __rand__ = __or__ = __ror__ = __xor__ = __rxor__ = _unknown
+    __nonzero__ = __len__ = __int__ = __long__ = __index__ = __hash__ = _decide
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __cmp__ = _decide
+    __iter__ = __getitem__ = __contains__ = _decide
+
+
+class _WidthProbe(object):
+    """ Stands in for the decoder to find out how many bits an event parser
+    reads. Every value read is :class:`_Unknown` so any parser that reads a
+    different number of bits depending on the data raises an exception.
+    """
+    def __init__(self, bit_shift):
+        self.pos = bit_shift
+
+    def _read(self, count):
+        if not isinstance(count, (int, long)):
+            raise _DataDependent()
+        self.pos += count
+        return _Unknown()
+
+    def read_bits(self, count):
+        return self._read(count)
+
+    def read_bool(self):
+        return self._read(1)
+
+    def read_uint8(self):
+        return self._read(8)
+
+    def read_uint16(self):
+        return self._read(16)
+
+    def read_uint32(self):
+        return self._read(32)
+
+    def read_uint64(self):
+        return self._read(64)
+
+    def read_bytes(self, count):
+        return self._read(count*8)
+
+    def byte_align(self):
+        self.pos = (self.pos + 7) & ~7
+
+    def read_aligned_bytes(self, count):
+        self.byte_align()
+        return self._read(count*8)
+
+
+def _skip_parser(width):
+    def skip(data):
+        data.skip_bits(width)
+    return skip
+
+
+class _EventFilter(object):
+    """ Wraps an event class or factory and drops the events it creates that
+    aren't one of the ``event_types`` by returning None instead.
+    """
+    def __init__(self, event_class, event_types):
+        self.event_class = event_class
+        self.event_types = event_types
+
+    def __call__(self, frame, pid, event_data):
+        event = self.event_class(frame, pid, event_data)
+        return event if isinstance(event, self.event_types) else None
+
+
+class GameEventSequence(object):
+    """
+    :param reader: The :class:`GameEventsReader_Base` for the replay
+    :param data: The contents of the replay.game.events file
+    :param replay: The replay the events belong to
+
+    A read only sequence of game events that are only decoded when they are
+    accessed. Supports ``len()``, indexing, slicing, and iteration like a
+    list and :meth:`between` to get the events in a range of frames.
+
+    On creation the events are scanned once without being constructed and a
+    checkpoint is taken every :attr:`checkpoint_interval` events. Accessing
+    an event decodes only the events between the checkpoints around it. The
+    most recently decoded block of events is kept around.
+
+    Used when replays are loaded with the ``lazy_events`` option.
+    """
+
+    #: The number of events between checkpoints
+    checkpoint_interval = 256
+
+    #: The frame of the last event
+    frames = 0
+
+    def __init__(self, reader, data, replay):
+        self.reader = reader
+        self.replay = replay
+        self._decoder = reader.get_decoder(data, replay)
+        self._checkpoints, self._length, self.frames = reader.scan_events(self._decoder, replay, self.checkpoint_interval)
+        self._checkpoint_frames = [frame for offset, fstamp, frame in self._checkpoints]
+        self._block_index = None
+        self._block = None
+
+    def _get_block(self, index):
+        if index != self._block_index:
+            offset, fstamp, frame = self._checkpoints[index]
+            self._decoder.seek(offset)
+            self._block = self.reader.read_events(self._decoder, self.replay, fstamp, self.checkpoint_interval)
+            self._block_index = index
+        return self._block
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("game event index out of range")
+
+        block, offset = divmod(index, self.checkpoint_interval)
+        return self._get_block(block)[offset]
+
+    def __iter__(self):
+        for index in xrange(len(self._checkpoints)):
+            for event in self._get_block(index):
+                yield event
+
+    def between(self, start_frame, stop_frame):
+        """ Returns a list of the events from ``start_frame`` up to but not
+        including ``stop_frame``. Only the blocks of events that overlap the
+        frame range are decoded.
+        """
+        events = list()
+        index = max(bisect_left(self._checkpoint_frames, start_frame) - 1, 0)
+        while index < len(self._checkpoints) and self._checkpoint_frames[index] < stop_frame:
+            events.extend(event for event in self._get_block(index) if start_frame <= event.frame < stop_frame)
+            index += 1
+        return events
+
+
 class GameEventsReader_Base(Reader):
 
+    #: Event parsers start 4 bits into a byte. Each event is byte aligned
+    #: and begins with a whole byte frame count followed by the 5 bit player
+    #: id and the 7 bit event type.
+    EVENT_BIT_SHIFT = 4
+
+    #: The base class of the events made by each event factory
+    EVENT_FACTORIES = {
+        create_command_event: AbilityEvent,
+        create_control_group_event: HotkeyEvent,
+    }
+
+    #: The compiled EVENT_DISPATCH by event types, see :meth:`get_event_table`
+    _event_tables = None
+
     def __init__(self):
         self.EVENT_DISPATCH = {
             0: (None, self.unknown_event),
@@ -572,12 +813,70 @@ class GameEventsReader_Base(Reader):
             96: (None, self.trigger_game_credits_finished_event),
         }
 
+    def get_event_width(self, event_parser):
+        """ Returns the number of bits ``event_parser`` reads if it is always
+        the same, otherwise None. This is worked out by running the parser on
+        a probe that reads placeholder values instead of real data.
+        """
+        probe = _WidthProbe(self.EVENT_BIT_SHIFT)
+        try:
+            event_parser(probe)
+        except Exception:
+            return None
+        return probe.pos - self.EVENT_BIT_SHIFT
+
+    def get_event_table(self, event_types=None):
+        """ Compiles the EVENT_DISPATCH into a list of ``(event_class, parser)``
+        pairs indexed by the 7 bit event type. Events that aren't constructed
+        and always have the same length get a parser that skips over them
+        without reading anything. Unknown event types get ``(None, None)``.
+
+        If given a tuple of ``event_types`` only events of those types are
+        constructed. The rest are skipped like unused events. Event types that
+        only some of the events of an event class or factory belong to are
+        filtered after they are constructed.
+
+        Each table is compiled once, the first time it is used.
+        """
+        if self._event_tables is None:
+            self._event_tables = dict()
+
+        if event_types not in self._event_tables:
+            event_table = [(None, None)]*128
+            for event_type, (event_class, event_parser) in self.EVENT_DISPATCH.items():
+                if event_class is not None and event_types is not None:
+                    base_class = self.EVENT_FACTORIES.get(event_class, event_class)
+                    if issubclass(base_class, event_types):
+                        pass
+                    elif any(issubclass(cls, base_class) for cls in event_types):
+                        event_class = _EventFilter(event_class, event_types)
+                    else:
+                        event_class = None
+
+                if event_class is None:
+                    width = self.get_event_width(event_parser)
+                    if width is not None:
+                        event_parser = _skip_parser(width)
+                event_table[event_type] = (event_class, event_parser)
+            self._event_tables[event_types] = event_table
+        return self._event_tables[event_types]
+
     def __call__(self, data, replay):
-        data = BitPackedDecoder(data)
+        return self.read_events(self.get_decoder(data, replay), replay)
+
+    def read_events(self, data, replay, fstamp=0, limit=None):
+        """ Reads game events from the current position of the ``data``
+        decoder until the end of the data, until ``limit`` events have been
+        read, or until the events pass the replay's ``max_frame``. The frame
+        counts are added to ``fstamp``. Events before the ``min_frame`` are
+        skipped without being constructed.
+        """
         game_events = list()
+        min_frame, max_frame = self.get_frame_window(replay)
 
         # method short cuts, avoid dict lookups
-        EVENT_DISPATCH = self.EVENT_DISPATCH
+        event_table = self.get_event_table(self.get_event_types(replay, 'event_types'))
+        skip_table = self.get_event_table(tuple())
         debug = replay.opt.debug
         tell = data.tell
         read_frames =  data.read_frames
@@ -586,23 +885,28 @@ class GameEventsReader_Base(Reader):
         append = game_events.append
 
         try:
-            fstamp = 0
-            event_start = 0
+            event_start = tell()
             data_length = data.length
-            while event_start != data_length:
+            while event_start != data_length and len(game_events) != limit:
                 fstamp += read_frames()
+                if fstamp > max_frame:
+                    break
+
                 pid = read_bits(5)
                 event_type = read_bits(7)
-                event_class, event_parser = EVENT_DISPATCH.get(event_type, (None, None))
-                if event_parser != None:
-                    event_data = event_parser(data)
-                    if event_class != None:
-                        event = event_class(fstamp, pid, event_data)
+                if fstamp < min_frame:
+                    event_class, event_parser = skip_table[event_type]
+                else:
+                    event_class, event_parser = event_table[event_type]
+                if event_class is not None:
+                    event = event_class(fstamp, pid, event_parser(data))
+                    if event is not None:
                         append(event)
                         if debug:
                             event.bytes = data.read_range(event_start, tell())
-                    else:
-                        pass # Skipping unused events
+
+                elif event_parser is not None:
+                    event_parser(data) # Skipping unused events
 
                 # Otherwise throw a read error
                 else:
@@ -617,36 +921,88 @@ class GameEventsReader_Base(Reader):
         except EOFError as e:
             raise ReadError("EOFError error '{0}' unknown at position {1}.".format(e.msg, hex(event_start)), event_type, event_start, replay, game_events, data)
 
-    # Don't want to do this more than once
-    SINGLE_BIT_MASKS = [0x1 << i for i in range(2**9)]
+    def scan_events(self, data, replay, interval):
+        """ Reads through the game events without constructing them. Returns
+        a list of checkpoints, the number of events, and the frame of the
+        last event.
+
+        A checkpoint is taken before every ``interval`` events. Each is an
+        ``(offset, fstamp, frame)`` tuple holding the byte offset of the event,
+        the frame count before it, and the frame of the event.
+
+        Like :meth:`read_events` only the events within the replay's
+        ``min_frame`` and ``max_frame`` are counted.
+        """
+        checkpoints = list()
+        count = 0
+        last_frame = 0
+        min_frame, max_frame = self.get_frame_window(replay)
+
+        # method short cuts, avoid dict lookups
+        event_table = self.get_event_table(self.get_event_types(replay, 'event_types'))
+        skip_table = self.get_event_table(tuple())
+        tell = data.tell
+        read_frames =  data.read_frames
+        read_bits = data.read_bits
+        byte_align = data.byte_align
+
+        try:
+            fstamp = 0
+            event_start = tell()
+            data_length = data.length
+            while event_start != data_length:
+                frame = fstamp + read_frames()
+                if frame > max_frame:
+                    break
+
+                pid = read_bits(5)
+                event_type = read_bits(7)
+                if frame < min_frame:
+                    event_class, event_parser = skip_table[event_type]
+                else:
+                    event_class, event_parser = event_table[event_type]
+                if event_class is not None:
+                    event_data = event_parser(data)
+                    # Filtered events have to be constructed to know if they count
+                    if event_class.__class__ is not _EventFilter or event_class(frame, pid, event_data) is not None:
+                        if count % interval == 0:
+                            checkpoints.append((event_start, fstamp, frame))
+                        count += 1
+                        last_frame = frame
+
+                elif event_parser is not None:
+                    event_parser(data)
+
+                else:
+                    raise ReadError("Event type {0} unknown at position {1}.".format(hex(event_type),hex(event_start)), event_type, event_start, replay, [], data)
+
+                fstamp = frame
+                byte_align()
+                event_start = tell()
+
+            return checkpoints, count, last_frame
+        except ParseError as e:
+            raise ReadError("Parse error '{0}' unknown at position {1}.".format(e.msg, hex(event_start)), event_type, event_start, replay, [], data)
+        except EOFError as e:
+            raise ReadError("EOFError error '{0}' unknown at position {1}.".format(e.msg, hex(event_start)), event_type, event_start, replay, [], data)
 
     def read_selection_bitmask(self, data, mask_length):
-        bits_left = mask_length
+        """ Returns the selection mask as a ``(bit_mask, mask_length)`` tuple.
+        Bit i of the integer is set if the unit at index i is deselected.
+        """
         bits = data.read_bits(mask_length)
-        mask = list()
-        shift_diff = (mask_length+data._bit_shift)%8 - data._bit_shift
-        if shift_diff > 0:
-            mask = [bits & data._lo_masks[shift_diff]]
-            bits = bits >> shift_diff
-            bits_left -= shift_diff
-        elif shift_diff < 0:
-            mask = [bits & data._lo_masks[8+shift_diff]]
-            bits = bits >> (8+shift_diff)
-            bits_left -= 8+shift_diff
-
-        # Now shift the rest of the bits off into the mask in byte-sized
-        # chunks in reverse order. No idea why it'd be stored like this.
-        while bits_left!=0:
-            mask.insert(0,bits & 0xFF)
-            bits = bits >> 8
-            bits_left -= 8
-
-        # Compile the finished mask into a large integer for bit checks
-        bit_mask = sum([c<<(i*8) for i,c in enumerate(mask)])
-
-        # Change mask representation from an int to a bit array with
-        # True => Deselect, False => Keep
-        return [(bit_mask & bit != 0) for bit in self.SINGLE_BIT_MASKS[:mask_length]]
+
+        # The mask bits are stored in byte-sized chunks in reverse order
+        # with the partial byte, if any, at the end. No idea why it'd be
+        # stored like this.
+        head_length = mask_length % 8
+        byte_count = mask_length/8
+        bit_mask = (bits & data._lo_masks[head_length]) << byte_count*8
+        if byte_count:
+            chunks = unhexlify('%0*x' % (byte_count*2, bits >> head_length))
+            bit_mask |= int(hexlify(chunks[::-1]), 16)
+
+        return (bit_mask, mask_length)
 
 class GameEventsReader_15405(GameEventsReader_Base):
 
@@ -1666,16 +2022,53 @@ class TrackerEventsReader_Base(Reader):
             8: UnitPositionsEvent,
         }
 
+    #: Events that set up the state of units. These are still read before the
+    #: replay's ``min_frame`` so that units in the window have their context.
+    CONTEXT_EVENT_TYPES = (UnitBornEvent, UnitDiedEvent, UnitOwnerChangeEvent, UnitTypeChangeEvent, UnitInitEvent, UnitDoneEvent)
+
+    #: Event data is decoded into tuples indexed by struct key.
+    EVENT_SCHEMA = Struct(tuple)
+
+    #: Schemas for event types with nested data. The player stats of the
+    #: :class:`PlayerStatsEvent` are tuples too and the :class:`UnitPositionsEvent`
+    #: items are decoded into integer arrays.
+    EVENT_SCHEMAS = {
+        0: Struct(tuple, {1: Struct(tuple)}),
+        8: Struct(tuple, {1: Array(typecode='l')}),
+    }
+
     def __call__(self, data, replay):
-        decoder = BitPackedDecoder(data)
+        decoder = self.get_decoder(data, replay)
+        read_value = compile_schema()
+        read_default = compile_schema(self.EVENT_SCHEMA)
+        read_events = dict((etype, compile_schema(schema)) for etype, schema in self.EVENT_SCHEMAS.items())
+
+        # Only construct the event types asked for with the tracker_event_types option
+        event_types = self.get_event_types(replay, 'tracker_event_types')
+        if event_types is None:
+            event_dispatch = self.EVENT_DISPATCH
+        else:
+            event_dispatch = dict((etype, event_class) for etype, event_class in self.EVENT_DISPATCH.items() if issubclass(event_class, event_types))
+        context_dispatch = dict((etype, event_class) for etype, event_class in event_dispatch.items() if issubclass(event_class, self.CONTEXT_EVENT_TYPES))
+        min_frame, max_frame = self.get_frame_window(replay)
 
         frames = 0
-        events = list()
+        tracker_events = list()
         while not decoder.done():
-            frames += decoder.read_struct()
-            etype = decoder.read_struct()
-            event_data = decoder.read_struct()
-            event = self.EVENT_DISPATCH[etype](frames, event_data)
-            events.append(event)
-
-        return events
+            frames += read_value(decoder)
+            if frames > max_frame:
+                break
+
+            # Before the min_frame only the unit events are read, see Replay.load_tracker_events
+            dispatch = event_dispatch if frames >= min_frame else context_dispatch
+            etype = read_value(decoder)
+            if etype not in dispatch:
+                # Skip event types we don't have a class for yet or don't want
+                decoder.skip_struct()
+                continue
+
+            event_data = read_events.get(etype, read_default)(decoder)
+            event = dispatch[etype](frames, event_data)
+            tracker_events.append(event)
+
+        return tracker_events
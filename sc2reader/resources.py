@@ -1,30 +1,35 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import os
 import sys
 
+import mmap
 import zlib
-import pprint
+import struct
+import heapq
+import functools
 import hashlib
 import collections
+from array import array
+from bisect import bisect_left
 from datetime import datetime
 import time
-from StringIO import StringIO
 from collections import defaultdict, deque, namedtuple
-from xml.etree import ElementTree
 
-import urllib2
 from mpyq import MPQArchive
 
 import mpyq
 from sc2reader import utils
-from sc2reader.decoders import BitPackedDecoder
+from sc2reader.decoders import get_bit_decoder
 from sc2reader import log_utils
 from sc2reader import readers
 from sc2reader import exceptions
 from sc2reader.data import builds as datapacks
 from sc2reader.exceptions import SC2ReaderLocalizationError
 from sc2reader.objects import Player, Observer, Team, PlayerSummary, Graph, BuildEntry
+from sc2reader.events.base import Event
+from sc2reader.events.tracker import TrackerEvent
 from sc2reader.constants import REGIONS, LOCALIZED_RACES, GAME_SPEED_FACTOR, LOBBY_PROPERTIES, GATEWAY_LOOKUP
 
 
@@ -37,6 +42,159 @@ def real_type(teams):
         return "v".join(str(size) for size in sorted(team_sizes))
 
 
+def read_header_data(decoder):
+    """ Reads the version and length of a replay from the ``decoder`` over the
+    contents of the replay's MPQ user data block.
+    """
+    header_data = decoder.read_struct()
+    versions = header_data[1].values()
+    return utils.AttributeDict(
+        versions=versions,
+        frames=header_data[3],
+        build=versions[4],
+        base_build=versions[5],
+        release_string="{0}.{1}.{2}.{3}".format(*versions[1:5]),
+    )
+
+
+def peek_replay(replay_file):
+    """
+    :param replay_file: A file-like object holding a replay
+
+    Returns an :class:`~sc2reader.utils.AttributeDict` of the ``versions``,
+    ``build``, ``base_build``, ``frames``, and ``release_string`` of the
+    replay. Only the user data block at the start of the MPQ archive is read,
+    the rest of the file isn't read, hashed, or unpacked.
+    """
+    if hasattr(replay_file, 'seek'):
+        replay_file.seek(0)
+
+    # The user data header gives the size of the user data content after it
+    data = replay_file.read(16)
+    if len(data) != 16 or data[:4] != 'MPQ\x1b':
+        raise exceptions.MPQError("Replay file has no MPQ user data header")
+    user_data_size, mpq_header_offset, content_size = struct.unpack('<3I', data[4:])
+
+    content = replay_file.read(content_size)
+    if len(content) != content_size:
+        raise exceptions.MPQError("Replay file ends inside the MPQ user data")
+    return read_header_data(get_bit_decoder('default')(content))
+
+
+#: Non-cryptographic checksums that can be used as the ``hash_algorithm``
+#: for a fast file hash. Any algorithm supported by hashlib works too.
+CHECKSUMS = {
+    'crc32': zlib.crc32,
+    'adler32': zlib.adler32,
+}
+
+
+def _iter_chunks(file_object):
+    if isinstance(file_object, mmap.mmap):
+        yield file_object
+    elif hasattr(file_object, 'getvalue'):
+        yield file_object.getvalue()
+    else:
+        # Read in chunks to avoid making a full copy of the contents
+        position = file_object.tell()
+        file_object.seek(0)
+        try:
+            for chunk in iter(lambda: file_object.read(65536), ''):
+                yield chunk
+        finally:
+            file_object.seek(position)
+
+
+def hash_file(file_object, algorithm='sha256'):
+    """
+    :param file_object: The file-like object holding the contents to hash
+    :param algorithm: One of the :data:`CHECKSUMS` or a hashlib algorithm
+
+    Returns the hex digest of the contents of ``file_object``. Memory maps and
+    in memory files are hashed from the contents they already hold. Other
+    files are read in chunks and left at the position they were at.
+    """
+    if algorithm in CHECKSUMS:
+        checksum = CHECKSUMS[algorithm]
+        value = checksum('')
+        for chunk in _iter_chunks(file_object):
+            value = checksum(chunk, value)
+        return '{0:08x}'.format(value & 0xffffffff)
+
+    filehash = hashlib.new(algorithm)
+    for chunk in _iter_chunks(file_object):
+        filehash.update(chunk)
+    return filehash.hexdigest()
+
+
+def _default_readers():
+    ANY = (None, None)
+    message_reader = readers.MessageEventsReader_Base()
+
+    # Each reader lists the versions[1], build, and base_build ranges it is used for
+    return {
+        'replay.details': utils.IntervalIndex([
+            (readers.DetailsReader_Base(),              [ANY, (None, 22612), ANY]),
+            (readers.DetailsReader_22612(),             [(1, 2), (22612, None), ANY]),
+            (readers.DetailsReader_Beta(),              [(2, 3), (None, 24764), ANY]),
+            (readers.DetailsReader_Beta_24764(),        [ANY, (24764, None), ANY]),
+        ]),
+        'replay.initData': utils.IntervalIndex([
+            (readers.InitDataReader_Base(),             [ANY, (None, 23260), ANY]),
+            (readers.InitDataReader_23260(),            [ANY, (23260, 24764), ANY]),
+            (readers.InitDataReader_24764(),            [ANY, (24764, None), ANY]),
+        ]),
+        'replay.message.events': utils.IntervalIndex([
+            (message_reader,                            [ANY, (None, 24247), ANY]),
+            (message_reader,                            [(1, 2), ANY, ANY]),
+            (readers.MessageEventsReader_Beta_24247(),  [(2, 3), (24247, None), ANY]),
+        ]),
+        'replay.attributes.events': utils.IntervalIndex([
+            (readers.AttributesEventsReader_Base(),     [ANY, (None, 17326), ANY]),
+            (readers.AttributesEventsReader_17326(),    [ANY, (17326, None), ANY]),
+        ]),
+        'replay.game.events': utils.IntervalIndex([
+            (readers.GameEventsReader_15405(),          [ANY, ANY, (15405, 16561)]),
+            (readers.GameEventsReader_16561(),          [ANY, ANY, (16561, 17326)]),
+            (readers.GameEventsReader_17326(),          [ANY, ANY, (17326, 18574)]),
+            (readers.GameEventsReader_18574(),          [ANY, ANY, (18574, 19595)]),
+            (readers.GameEventsReader_19595(),          [ANY, ANY, (19595, 22612)]),
+            (readers.GameEventsReader_22612(),          [ANY, ANY, (22612, 23260)]),
+            (readers.GameEventsReader_23260(),          [ANY, ANY, (23260, 24247)]),
+            (readers.GameEventsReader_24247(),          [ANY, ANY, (24247, None)]),
+            (readers.GameEventsReader_HotSBeta(),       [(2, 3), (None, 24247), ANY]),
+        ]),
+        'replay.tracker.events': utils.IntervalIndex([
+            (readers.TrackerEventsReader_Base(),        [ANY, ANY, ANY]),
+        ]),
+    }
+
+#: The readers used for each replay data file unless one has been registered
+#: with :meth:`Replay.register_reader`. Readers are stateless so the same ones
+#: are shared by every replay.
+DEFAULT_READERS = _default_readers()
+
+#: The versions of the datapacks used for each expansion, by build, unless one
+#: has been registered with :meth:`Replay.register_datapack`. The datapacks
+#: are looked up in :data:`sc2reader.data.builds`, which loads them on first use.
+DEFAULT_DATAPACKS = {
+    'WoL': utils.IntervalIndex([
+        ('16117', [(16117, 17326)]),
+        ('17326', [(17326, 18092)]),
+        ('18092', [(18092, 19458)]),
+        ('19458', [(19458, 22612)]),
+        ('22612', [(22612, 24944)]),
+        ('24944', [(24944, None)]),
+    ]),
+    'HotS': utils.IntervalIndex([
+        ('base', [(None, 23925)]),
+        ('23925', [(23925, 24247)]),
+        ('24247', [(24247, 24765)]),
+        ('24764', [(24764, None)]),
+    ]),
+}
+
+
 class Resource(object):
     def __init__(self, file_object, filename=None, factory=None, **options):
         self.factory = factory
@@ -44,10 +202,57 @@ class Resource(object):
         self.logger = log_utils.get_logger(self.__class__)
         self.filename = filename or getattr(file_object,'name','Unavailable')
 
-        if hasattr(file_object, 'seek'):
-            file_object.seek(0)
-            self.filehash = hashlib.sha256(file_object.read()).hexdigest()
-            file_object.seek(0)
+        # Memory maps and in memory files are only hashed if the filehash is
+        # used. Check the algorithm now so a bad option fails on load instead
+        # of later.
+        self.hash_algorithm = self.opt.get('hash_algorithm', 'sha256')
+        if self.hash_algorithm not in CHECKSUMS:
+            hashlib.new(self.hash_algorithm)
+        self._file_object = file_object
+        self._filehash = None
+
+        # Other files are hashed now since they may be closed by the caller
+        # before the filehash is used.
+        if hasattr(file_object, 'seek') and not (isinstance(file_object, mmap.mmap) or hasattr(file_object, 'getvalue')):
+            self._filehash = hash_file(file_object, self.hash_algorithm)
+
+    @property
+    def filehash(self):
+        """ The hex digest of the file contents using the ``hash_algorithm``
+        option, sha256 by default. Computed the first time it is used for
+        memory maps and in memory files, and on load for other files.
+        """
+        if self._filehash is None:
+            if self._file_object is None and self.opt.get('mapped_path'):
+                # The factory's memory map is closed, hash the file instead
+                with open(self.opt.mapped_path, 'rb') as resource_file:
+                    self._filehash = hash_file(resource_file, self.hash_algorithm)
+            elif hasattr(self._file_object, 'seek'):
+                self._filehash = hash_file(self._file_object, self.hash_algorithm)
+        return self._filehash
+
+    @filehash.setter
+    def filehash(self, value):
+        self._filehash = value
+
+    def get_decoder(self, contents):
+        """ Wraps ``contents`` in the bit packed decoder selected by the ``decoder`` option """
+        return get_bit_decoder(self.opt.get('decoder', 'default'))(contents)
+
+    def _open_file(self):
+        # Maps the file at the ``mapped_path`` again if the factory's memory
+        # map was closed, see _close_file.
+        if self._file_object is None and self.opt.get('mapped_path'):
+            with open(self.opt.mapped_path, 'rb') as resource_file:
+                self._file_object = mmap.mmap(resource_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._file_object
+
+    def _close_file(self):
+        # Each memory map holds a file descriptor so the maps the factory opens
+        # are closed once the resource is loaded. Files passed in are left open.
+        if self.opt.get('mapped_path') and self._file_object is not None:
+            self._file_object.close()
+            self._file_object = None
 
 class Replay(Resource):
 
@@ -215,7 +420,11 @@ class Replay(Resource):
         self.map_hash = ""
         self.gateway = ""
         self.events = list()
+        self.game_events = list()
+        self.tracker_events = list()
+        self.context_events = list()
         self.events_by_type = defaultdict(list)
+        self._event_index = None
         self.teams, self.team = list(), dict()
         self.players, self.player = list(), utils.PersonDict()
         self.observers = list() #Unordered list of Observer
@@ -223,70 +432,210 @@ class Replay(Resource):
         self.person = utils.PersonDict() #Maps pid to Player/Observer
         self.attributes = defaultdict(dict)
         self.messages = list()
+        self.pings = list()
         self.recorder = None # Player object
         self.packets = list()
         self.objects = {}
         self.active_units = {}
         self.game_fps = 16.0
 
-        # Bootstrap the readers.
+        # Readers and datapacks registered for this replay only. These are
+        # checked before the DEFAULT_READERS and DEFAULT_DATAPACKS.
         self.registered_readers = defaultdict(list)
         self.register_default_readers()
-
-        # Bootstrap the datapacks.
         self.registered_datapacks= list()
         self.register_default_datapacks()
 
-        # Unpack the MPQ and read header data if requested
-        if load_level >= 0:
+        #: The highest load level loaded so far, see :meth:`load`
+        self.load_level = -1
+
+        #: True once the data only needed for loading is released, see :meth:`release_data`
+        self.is_lean = False
+
+        self._archive = None
+        self.load(load_level)
+
+    @property
+    def archive(self):
+        """ The :class:`mpyq.MPQArchive` of the replay file, opened the first
+        time it is used. None once the replay has released its data. """
+        if self._archive is None and not self.is_lean and self._open_file() is not None:
             try:
-                self.archive = mpyq.MPQArchive(replay_file, listfile=False)
+                self._archive = mpyq.MPQArchive(self._file_object, listfile=False)
             except Exception as e:
                 trace = sys.exc_info()[2]
                 raise exceptions.MPQError("Unable to construct the MPQArchive",e), None, trace
+        return self._archive
+
+    @archive.setter
+    def archive(self, value):
+        self._archive = value
+
+    def _close_file(self):
+        if self.opt.get('mapped_path'):
+            self._archive = None
+        super(Replay, self)._close_file()
 
-            header_content = self.archive.header['user_data_header']['content']
-            header_data = BitPackedDecoder(header_content).read_struct()
-            self.versions = header_data[1].values()
-            self.frames = header_data[3]
-            self.build = self.versions[4]
-            self.base_build = self.versions[5]
-            self.release_string = "{0}.{1}.{2}.{3}".format(*self.versions[1:5])
+    def load(self, load_level=4):
+        """
+        :param load_level: The load level to load the replay up to
+
+        Loads the replay up to the given ``load_level``, running only the
+        stages that haven't been loaded yet. The archive, raw data, readers,
+        and datapack from earlier stages are reused so a replay loaded at
+        ``load_level=1`` can be loaded further without being parsed again.
+        Plugins are not run again. Returns the replay.
+        """
+        loaded = self.load_level
+        if load_level <= loaded:
+            return self
+        if self.is_lean:
+            raise ValueError("Lean replays can't be loaded further, the archive was released.")
+
+        # Unpack the MPQ and read header data if requested
+        if loaded < 0 <= load_level:
+            header = self._read_header()
+            self.versions = header.versions
+            self.frames = header.frames
+            self.build = header.build
+            self.base_build = header.base_build
+            self.release_string = header.release_string
             self.game_length = utils.Length(seconds=self.frames/16)
             self.length = self.real_length = utils.Length(seconds=int(self.frames/self.game_fps))
 
         # Load basic details if requested
-        if load_level >= 1:
+        if loaded < 1 <= load_level:
             for data_file in ['replay.initData','replay.details','replay.attributes.events']:
                 self._read_data(data_file, self._get_reader(data_file))
             self.load_details()
             self.datapack = self._get_datapack()
 
             # Can only be effective if map data has been loaded
-            if options.get('load_map', False):
+            if self.opt.get('load_map', False):
                 self.load_map()
 
         # Load players if requested
-        if load_level >= 2:
+        if loaded < 2 <= load_level:
             for data_file in ['replay.message.events']:
                 self._read_data(data_file, self._get_reader(data_file))
             self.load_messages()
             self.load_players()
 
         # Load events if requested
-        if load_level >= 3:
+        if loaded < 3 <= load_level:
             for data_file in ['replay.game.events']:
-                self._read_data(data_file, self._get_reader(data_file))
+                reader = self._get_reader(data_file)
+                if self.opt.get('lazy_events', False):
+                    reader = functools.partial(readers.GameEventSequence, reader)
+                self._read_data(data_file, reader)
             self.load_events()
 
         # Load tracker events if requested
-        if load_level >= 4:
+        if loaded < 4 <= load_level:
             for data_file in ['replay.tracker.events']:
                 self._read_data(data_file, self._get_reader(data_file))
             self.load_tracker_events()
 
+        self.load_level = load_level
+        self.load_context()
+        if self.opt.get('lean', False):
+            self.release_data()
+        else:
+            # The file is mapped again if a later load needs the archive
+            self._close_file()
+        return self
+
+    def release_data(self):
+        """ Releases the archive, the file contents, and the raw data along with
+        the game and tracker event lists and :attr:`events_by_type`, leaving
+        :attr:`events` as the only container of the loaded events. Use
+        :meth:`query` to get events of a type. The file hash is computed first
+        since the file contents are released. Lazy game events are kept.
+
+        Called at the end of loading when the ``lean`` option is set. Lean
+        replays can't be loaded further with :meth:`load`.
+        """
+        self.filehash
+        self.archive = None
+        self._close_file()
+        self._file_object = None
+        self.raw_data = dict()
+        self.events_by_type = defaultdict(list)
+        if not isinstance(self.game_events, readers.GameEventSequence):
+            self.game_events = None
+        self.tracker_events = None
+        self.context_events = list()
+        self.is_lean = True
+
+    def memory_report(self):
+        """ Returns an :class:`~sc2reader.utils.AttributeDict` estimating the
+        bytes held by the replay's events, indexes, raw data, and archive along
+        with their ``total``. Objects shared between them are counted under
+        the first one listed. The archive is the size of the file contents
+        the replay still holds.
+        """
+        seen = set()
+        follow = lambda obj: isinstance(obj, (Event, TrackerEvent))
+        report = utils.AttributeDict()
+        report.events = utils.get_size(self.events, seen, follow)
+        report.game_events = utils.get_size(self.game_events, seen, follow)
+        report.tracker_events = utils.get_size(self.tracker_events, seen, follow)
+        report.message_events = utils.get_size([self.messages, self.pings, self.packets], seen, follow)
+        report.events_by_type = utils.get_size(self.events_by_type, seen, follow)
+        report.event_index = utils.get_size(self._event_index, seen, follow)
+        report.raw_data = utils.get_size(self.raw_data, seen, follow)
+
+        report.archive = 0
+        file_object = self._file_object
+        if file_object is not None and hasattr(file_object, 'seek'):
+            position = file_object.tell()
+            file_object.seek(0, os.SEEK_END)
+            report.archive = file_object.tell()
+            file_object.seek(position)
+
+        report.total = sum(report.values())
+        return report
+
+    def load_context(self):
+        """ Merges the loaded events into :attr:`events` and loads their context.
+        Context from an earlier load is cleared first so that events loaded
+        in later stages get the same context as a replay loaded all at once.
+        """
+        # Each event stream is already in frame order so they are merged once
+        # they are all loaded instead of sorting them together as they load.
+        self.events = list(self.iter_events())
+
+        self.objects = {}
+        self.active_units = {}
+        for person in self.people:
+            person.events = list()
+        for player in self.players:
+            player.units = list()
+            player.killed_units = list()
+
+        for event in self.context_events:
+            event.load_context(self)
+
+        # The query index is built from the events the first time it is used
+        events_by_type = self.events_by_type = defaultdict(list)
+        self._event_index = None
         for event in self.events:
             event.load_context(self)
+            events_by_type[event.name].append(event)
+
+    def _build_event_index(self):
+        # Index the events by class and pid. Each index entry is a pair of
+        # arrays holding the frames and positions of the events in
+        # self.events, both in frame order.
+        event_index = dict()
+        for position, event in enumerate(self.events):
+            key = (event.__class__, getattr(event, 'pid', None))
+            if key not in event_index:
+                event_index[key] = (array('l'), array('l'))
+            frames, positions = event_index[key]
+            frames.append(event.frame)
+            positions.append(position)
+        return event_index
 
 
     def load_details(self):
@@ -294,8 +643,8 @@ class Replay(Resource):
             # Organize the attribute data to be useful
             self.attributes = defaultdict(dict)
             attributesEvents = self.raw_data['replay.attributes.events']
-            for attr in attributesEvents:
-                self.attributes[attr.player][attr.name] = attr.value
+            for header, attr_id, player, name, value in attributesEvents:
+                self.attributes[player][name] = value
 
             # Populate replay with attributes
             self.speed = self.attributes[16]['Game Speed']
@@ -481,9 +830,6 @@ class Replay(Resource):
             self.messages = self.raw_data['replay.message.events'].messages
             self.pings = self.raw_data['replay.message.events'].pings
             self.packets = self.raw_data['replay.message.events'].packets
-            self.events += self.messages+self.pings+self.packets
-
-        self.events = sorted(self.events, key=lambda e: e.frame)
 
     def load_events(self):
         # Copy the events over
@@ -492,11 +838,15 @@ class Replay(Resource):
             return
 
         self.game_events = self.raw_data['replay.game.events']
-        self.events = sorted(self.game_events+self.events, key=lambda e: e.frame)
+        if isinstance(self.game_events, readers.GameEventSequence):
+            last_frame = self.game_events.frames
+        else:
+            last_frame = self.game_events[-1].frame if self.game_events else 0
+        last_frame = max([last_frame]+[events[-1].frame for events in (self.messages, self.pings, self.packets) if events])
 
         # hideous hack for HotS 2.0.0.23925, see https://github.com/GraylinKim/sc2reader/issues/87
-        if self.events and self.events[-1].frame > self.frames:
-            self.frames = self.events[-1].frame
+        if last_frame > self.frames:
+            self.frames = last_frame
             self.length = utils.Length(seconds=int(self.frames/self.game_fps))
 
 
@@ -504,8 +854,63 @@ class Replay(Resource):
         if 'replay.tracker.events' not in self.raw_data:
             return
 
-        self.tracker_events = self.raw_data['replay.tracker.events']
-        self.events = sorted(self.tracker_events + self.events, key=lambda e: e.frame)
+        # Unit events before the min_frame are read to give the units in the
+        # window their owners and types. They only load their context and
+        # aren't part of the replay's events. Game events before the min_frame
+        # aren't read at all so units only seen in them have no context.
+        tracker_events = self.raw_data['replay.tracker.events']
+        min_frame = self.opt.get('min_frame') or 0
+        start = bisect_left([event.frame for event in tracker_events], min_frame) if min_frame else 0
+        self.context_events = tracker_events[:start]
+        self.tracker_events = tracker_events[start:] if start else tracker_events
+
+    def iter_events(self):
+        """ Returns a generator over the loaded events in frame order. The
+        tracker, game, and message event streams are merged as they are read
+        without building a combined list. Events in the same frame come in
+        tracker, game, chat, ping, and then packet order.
+
+        Lazy game events are only decoded when accessed so they aren't merged
+        into the replay events or given any context.
+        """
+        if self.is_lean:
+            return iter(self.events)
+
+        game_events = self.game_events if isinstance(self.game_events, list) else list()
+        return utils.merge_events(self.tracker_events, game_events, self.messages, self.pings, self.packets)
+
+    def query(self, types=None, pids=None, frames=None):
+        """
+        :param types: A list of event classes or class names, subclasses match too
+        :param pids: A list of pids, only events with a matching ``pid`` match
+        :param frames: A ``(start, stop)`` frame range, ``stop`` is excluded
+
+        Returns the events in :attr:`events` that match all of the given
+        filters, in order. The events are found with indexes built by the
+        first query instead of scanning through all of them.
+        """
+        if self._event_index is None:
+            self._event_index = self._build_event_index()
+
+        if types is not None:
+            types = set(types)
+        if pids is not None:
+            pids = set(pids)
+        start, stop = frames if frames is not None else (None, None)
+
+        matches = list()
+        for (event_class, pid), (event_frames, positions) in self._event_index.items():
+            if pids is not None and pid not in pids:
+                continue
+            if types is not None and not any(cls in types or cls.__name__ in types for cls in event_class.__mro__):
+                continue
+
+            lo = 0 if start is None else bisect_left(event_frames, start)
+            hi = len(event_frames) if stop is None else bisect_left(event_frames, stop)
+            if lo < hi:
+                matches.append(positions[lo:hi])
+
+        return [self.events[position] for position in heapq.merge(*matches)]
 
 
     def register_reader(self, data_file, reader, filterfunc=lambda r: True):
@@ -550,42 +955,14 @@ class Replay(Resource):
 
     # Override points
     def register_default_readers(self):
-        """Registers factory default readers."""
-        self.register_reader('replay.details', readers.DetailsReader_Base(), lambda r: r.build < 22612)
-        self.register_reader('replay.details', readers.DetailsReader_22612(), lambda r: r.build >= 22612 and r.versions[1]==1)
-        self.register_reader('replay.details', readers.DetailsReader_Beta(), lambda r: r.build < 24764 and r.versions[1]==2)
-        self.register_reader('replay.details', readers.DetailsReader_Beta_24764(), lambda r: r.build >= 24764)
-        self.register_reader('replay.initData', readers.InitDataReader_Base(), lambda r: r.build < 23260)
-        self.register_reader('replay.initData', readers.InitDataReader_23260(), lambda r: r.build >= 23260 and r.build < 24764)
-        self.register_reader('replay.initData', readers.InitDataReader_24764(), lambda r: r.build >= 24764)
-        self.register_reader('replay.message.events', readers.MessageEventsReader_Base(), lambda r: r.build < 24247 or r.versions[1]==1)
-        self.register_reader('replay.message.events', readers.MessageEventsReader_Beta_24247(), lambda r: r.build >= 24247 and r.versions[1]==2)
-        self.register_reader('replay.attributes.events', readers.AttributesEventsReader_Base(), lambda r: r.build <  17326)
-        self.register_reader('replay.attributes.events', readers.AttributesEventsReader_17326(), lambda r: r.build >= 17326)
-        self.register_reader('replay.game.events', readers.GameEventsReader_15405(), lambda r: 15405 <= r.base_build < 16561)
-        self.register_reader('replay.game.events', readers.GameEventsReader_16561(), lambda r: 16561 <= r.base_build < 17326)
-        self.register_reader('replay.game.events', readers.GameEventsReader_17326(), lambda r: 17326 <= r.base_build < 18574)
-        self.register_reader('replay.game.events', readers.GameEventsReader_18574(), lambda r: 18574 <= r.base_build < 19595)
-        self.register_reader('replay.game.events', readers.GameEventsReader_19595(), lambda r: 19595 <= r.base_build < 22612)
-        self.register_reader('replay.game.events', readers.GameEventsReader_22612(), lambda r: 22612 <= r.base_build < 23260)
-        self.register_reader('replay.game.events', readers.GameEventsReader_23260(), lambda r: 23260 <= r.base_build < 24247)
-        self.register_reader('replay.game.events', readers.GameEventsReader_24247(), lambda r: 24247 <= r.base_build )
-        self.register_reader('replay.game.events', readers.GameEventsReader_HotSBeta(), lambda r: r.versions[1]==2 and r.build < 24247)
-        self.register_reader('replay.tracker.events', readers.TrackerEventsReader_Base(), lambda r: True)
-
+        """Registers readers for every replay of a subclass before it loads.
+        The factory default readers are in :data:`DEFAULT_READERS`."""
+        pass
 
     def register_default_datapacks(self):
-        """Registers factory default datapacks."""
-        self.register_datapack(datapacks['WoL']['16117'], lambda r: r.expansion=='WoL' and 16117 <= r.build < 17326)
-        self.register_datapack(datapacks['WoL']['17326'], lambda r: r.expansion=='WoL' and 17326 <= r.build < 18092)
-        self.register_datapack(datapacks['WoL']['18092'], lambda r: r.expansion=='WoL' and 18092 <= r.build < 19458)
-        self.register_datapack(datapacks['WoL']['19458'], lambda r: r.expansion=='WoL' and 19458 <= r.build < 22612)
-        self.register_datapack(datapacks['WoL']['22612'], lambda r: r.expansion=='WoL' and 22612 <= r.build < 24944)
-        self.register_datapack(datapacks['WoL']['24944'], lambda r: r.expansion=='WoL' and 24944 <= r.build)
-        self.register_datapack(datapacks['HotS']['base'], lambda r: r.expansion=='HotS' and r.build < 23925)
-        self.register_datapack(datapacks['HotS']['23925'], lambda r: r.expansion=='HotS' and 23925 <= r.build < 24247)
-        self.register_datapack(datapacks['HotS']['24247'], lambda r: r.expansion=='HotS' and 24247 <= r.build <= 24764 )
-        self.register_datapack(datapacks['HotS']['24764'], lambda r: r.expansion=='HotS' and 24764 <= r.build )
+        """Registers datapacks for every replay of a subclass before it loads.
+        The factory default datapacks are in :data:`DEFAULT_DATAPACKS`."""
+        pass
 
 
     # Internal Methods
@@ -593,22 +970,58 @@ class Replay(Resource):
         for callback, reader in self.registered_readers[data_file]:
             if callback(self):
                 return reader
-        else:
+
+        reader = None
+        if data_file in DEFAULT_READERS:
+            reader = DEFAULT_READERS[data_file].get((self.versions[1], self.build, self.base_build))
+        if reader is None:
             raise ValueError("Valid {0} reader could not found for build {1}".format(data_file, self.build))
+        return reader
 
     def _get_datapack(self):
         for callback, datapack in self.registered_datapacks:
             if callback(self):
                 return datapack
+
+        if self.expansion in DEFAULT_DATAPACKS:
+            version = DEFAULT_DATAPACKS[self.expansion].get((self.build,))
+            return datapacks[self.expansion][version] if version is not None else None
         else:
             return None
 
+    def _read_header(self):
+        # The header is cached with the raw data so that a replay with all of
+        # its data cached doesn't open the archive at all.
+        data_cache = self.opt.get('data_cache')
+        if data_cache is not None and 'user_data_header' in data_cache:
+            return data_cache['user_data_header']
+
+        header_content = self.archive.header['user_data_header']['content']
+        header = read_header_data(self.get_decoder(header_content))
+        if data_cache is not None:
+            data_cache['user_data_header'] = header
+        return header
+
     def _read_data(self, data_file, reader):
+        # The data_cache option holds already decoded raw data by data file
+        # and records the raw data that does get decoded. Data files missing
+        # from the archive are recorded as None.
+        data_cache = self.opt.get('data_cache')
+        if data_cache is not None and data_file in data_cache:
+            data = data_cache[data_file]
+            if data is not None:
+                self.raw_data[data_file] = data
+            return
+
         data = utils.extract_data_file(data_file,self.archive)
         if data:
             self.raw_data[data_file] = reader(data, self)
+            if data_cache is not None:
+                data_cache[data_file] = self.raw_data[data_file]
         elif self.opt.debug and data_file not in ['replay.message.events','replay.tracker.events']:
             raise ValueError("{0} not found in archive".format(data_file))
+        elif data_cache is not None:
+            data_cache[data_file] = None
 
 
 class Map(Resource):
@@ -641,7 +1054,7 @@ class Map(Resource):
         self.hash = map_hash
         self.gateway = gateway
         self.url = Map.get_url(gateway, map_hash)
-        self.archive = MPQArchive(map_file)
+        self._archive = None
         self.minimap = self.archive.read_file('Minimap.tga')
 
         # This will only populate the fields for maps with enUS localizations.
@@ -659,6 +1072,19 @@ class Map(Resource):
                 elif parts[0] == 'DocInfo/DescLong':
                     self.description = parts[1]
 
+    @property
+    def archive(self):
+        """ The :class:`mpyq.MPQArchive` of the map file, opened again if
+        the file was closed after loading. """
+        if self._archive is None:
+            self._archive = MPQArchive(self._open_file())
+        return self._archive
+
+    def _close_file(self):
+        if self.opt.get('mapped_path'):
+            self._archive = None
+        super(Map, self)._close_file()
+
     @classmethod
     def get_url(cls, gateway, map_hash):
         """Builds a download URL for the map from its components."""
@@ -672,6 +1098,9 @@ class Map(Resource):
 class Localization(Resource,dict):
 
     def __init__(self, s2ml_file, **options):
+        # Only localization files need an xml parser
+        from xml.etree import ElementTree
+
         Resource.__init__(self, s2ml_file, **options)
         xml = ElementTree.parse(s2ml_file)
         for entry in xml.findall('e'):
@@ -741,13 +1170,15 @@ class GameSummary(Resource):
         self.real_type = str()
 
         # The first 16 bytes appear to be some sort of compression header
-        buffer = BitPackedDecoder(zlib.decompress(summary_file.read()[16:]))
+        if not isinstance(summary_file, mmap.mmap):
+            summary_file = summary_file.read()
+        decoder = self.get_decoder(zlib.decompress(buffer(summary_file, 16)))
 
         # TODO: Is there a fixed number of entries?
         # TODO: Maybe the # of parts is recorded somewhere?
         self.parts = list()
-        while not buffer.done():
-            self.parts.append(buffer.read_struct())
+        while not decoder.done():
+            self.parts.append(decoder.read_schema())
 
         self.end_time = datetime.utcfromtimestamp(self.parts[0][8])
         self.game_speed = LOBBY_PROPERTIES[0xBB8][1][self.parts[0][0][1]]
@@ -1092,7 +1523,7 @@ class MapInfo(Resource):
 
     def __init__(self, info_file, filename=None, **options):
         super(MapInfo, self).__init__(info_file, filename, **options)
-        self.data = BitPackedDecoder(info_file).read_struct()
+        self.data = self.get_decoder(info_file).read_schema()
         self.map_name = self.data[0][7]
         self.language = self.data[0][13]
         parsed_hash = utils.parse_hash(self.data[0][1])
@@ -1132,7 +1563,7 @@ class MapHeader(Resource):
 
     def __init__(self, header_file, filename=None, **options):
         super(MapHeader, self).__init__(header_file, filename, **options)
-        self.data = BitPackedDecoder(header_file).read_struct()
+        self.data = self.get_decoder(header_file).read_schema()
 
         # Name
         self.name = self.data[0][1]
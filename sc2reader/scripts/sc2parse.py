@@ -36,13 +36,15 @@ def main():
         print "dealing with {}".format(folder)
         for path in sc2reader.utils.get_files(folder,extension='SC2Replay'):
             try:
-                rs = sc2reader.load_replay(path, load_level=0).release_string
+                # Load the replay further as needed instead of parsing it again
+                replay = sc2reader.load_replay(path, debug=True, load_level=0)
+                rs = replay.release_string
                 already_did = rs in releases_parsed
                 releases_parsed.add(rs)
                 if not args.one_each or not already_did:
-                    replay = sc2reader.load_replay(path, debug=True, load_level=1)
+                    replay.load(1)
                     if not args.one_each or replay.is_ladder:
-                        replay = sc2reader.load_replay(path, debug=True)
+                        replay.load(4)
 
                         client_pids = set([client.pid for client in replay.clients])
                         event_pids = set([ event.player.pid for event in replay.events if getattr(event, 'player',None) ])
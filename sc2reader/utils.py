@@ -3,6 +3,11 @@ from __future__ import absolute_import
 
 import os
 import sys
+import heapq
+import itertools
+from bisect import bisect_right
+from collections import deque
+from operator import itemgetter
 from datetime import timedelta
 
 from sc2reader.log_utils import loggable
@@ -46,6 +51,53 @@ class DepotFile(object):
         return self.url
 
 
+class IntervalIndex(object):
+    """
+    :param entries: A list of ``(value, ranges)`` pairs. The ranges hold one
+        half open ``(start, stop)`` integer range per dimension. Use None
+        for an open ended range.
+
+    An immutable index that finds the value whose ranges contain a point.
+    When ranges overlap, the entry listed last wins.
+
+    ::
+
+        index = IntervalIndex([
+            ('old', [(None, 100), (None, None)]),
+            ('new', [(100, None), (None, None)]),
+        ])
+        index.get((150, 2)) # 'new'
+
+    The range bounds split each dimension into a grid of cells and the value
+    for every cell is worked out up front. A lookup is just a binary search
+    per dimension and a dict lookup.
+    """
+    def __init__(self, entries):
+        entries = list(entries)
+        dimensions = len(entries[0][1]) if entries else 0
+
+        self._breakpoints = list()
+        for dimension in range(dimensions):
+            bounds = set()
+            for value, ranges in entries:
+                bounds.update(bound for bound in ranges[dimension] if bound is not None)
+            self._breakpoints.append(sorted(bounds))
+
+        self._cells = dict()
+        for cell in itertools.product(*[range(len(points)+1) for points in self._breakpoints]):
+            # Any point in the cell will do. Use the lowest one.
+            point = [points[i-1] if i else (points[0]-1 if points else 0) for i, points in zip(cell, self._breakpoints)]
+            for value, ranges in reversed(entries):
+                if all((start is None or start <= x) and (stop is None or x < stop) for x, (start, stop) in zip(point, ranges)):
+                    self._cells[cell] = value
+                    break
+
+    def get(self, point, default=None):
+        """ Returns the value for the cell containing ``point``, or ``default`` """
+        cell = tuple(bisect_right(points, x) for points, x in zip(self._breakpoints, point))
+        return self._cells.get(cell, default)
+
+
 class PersonDict(dict):
     """
     Supports lookup on both the player name and player id
@@ -183,6 +235,73 @@ def extract_data_file(data_file, archive):
         trace = sys.exc_info()[2]
         raise MPQError("Unable to extract file: {0}".format(data_file),e), None, trace
 
+def iter_bits(value, length):
+    """
+    :param value: The integer to read the bits from
+    :param length: The number of bits to read
+
+    Yields the lowest ``length`` bits of ``value`` as booleans, starting
+    with the least significant bit. Negative values are treated as two's
+    complement with an infinite number of leading 1s.
+    """
+    bits = bin(value & ((1 << length) - 1))[:1:-1][:length]
+    for bit in bits:
+        yield bit == '1'
+    for i in xrange(length - len(bits)):
+        yield False
+
+def _keyed_events(events, rank):
+    for seq, event in enumerate(events):
+        yield event.frame, rank, seq, event
+
+def merge_events(*streams):
+    """
+    :param streams: Iterables of events, each already in frame order
+
+    Returns a generator over the events of all the streams in frame order.
+    The streams are merged as they are read instead of being combined and
+    sorted. Events in the same frame come out in the order of their streams
+    and then in their order within the stream, like a stable sort would.
+    """
+    keyed = [_keyed_events(events, rank) for rank, events in enumerate(streams)]
+    return itertools.imap(itemgetter(3), heapq.merge(*keyed))
+
+def get_size(obj, seen, follow=lambda obj: False):
+    """
+    :param obj: The object to size
+    :param seen: A set of the ids of the objects already counted
+    :param follow: Returns True for objects whose attributes should be counted
+
+    Returns an estimate of the bytes used by ``obj`` and everything it holds
+    that isn't in ``seen``. Builtin containers are always followed but the
+    attributes and slots of other objects are only followed into when
+    ``follow`` returns True for them.
+    Counted objects are added to ``seen`` so that sizing several objects
+    with the same ``seen`` counts shared objects once.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif follow(obj):
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                for slot in ((slots,) if isinstance(slots, basestring) else slots):
+                    if slot != '__dict__' and hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return size
+
 def merged_dict(a, b):
     c = a.copy()
     c.update(b)
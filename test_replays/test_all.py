@@ -16,6 +16,15 @@ from sc2reader.plugins.replay import APMTracker, SelectionTracker, toJSON
 sc2reader.log_utils.log_to_console("INFO")
 
 
+def event_summary(event, context=True):
+    """ The name, frame, and pid of an event for comparing events between
+    loads, and the pid of its player unless the events have no context. """
+    summary = (event.name, event.frame, getattr(event, 'pid', None))
+    if context:
+        summary += (getattr(getattr(event, 'player', None), 'pid', None),)
+    return summary
+
+
 def test_teams():
     replay = sc2reader.load_replay("test_replays/1.2.2.17811/13.SC2Replay")
     assert replay.player[1].team.number != replay.player[2].team.number
@@ -307,3 +316,563 @@ def test_plugins():
     assert result["gateway"] == "cn"
     assert result["game_fps"] == 16.0
     assert result["is_ladder"] is True
+
+
+def test_fast_decoder():
+    for filename in ["test_replays/1.2.2.17811/1.SC2Replay", "test_replays/2.0.8.25604/mlg1.SC2Replay"]:
+        replay = sc2reader.load_replay(filename)
+        fast_replay = sc2reader.load_replay(filename, decoder='fast')
+        assert len(fast_replay.events) == len(replay.events)
+        for event, fast_event in zip(replay.events, fast_replay.events):
+            assert type(fast_event) == type(event)
+            assert fast_event.frame == event.frame
+            assert str(fast_event) == str(event)
+
+    with pytest.raises(ValueError):
+        sc2reader.load_replay("test_replays/1.2.2.17811/1.SC2Replay", decoder='unknown')
+
+
+def test_mmap_resources():
+    factory = sc2reader.factories.SC2Factory()
+    replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    copied_replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", mmap=False)
+    assert replay.filehash == copied_replay.filehash
+    assert len(replay.events) == len(copied_replay.events)
+
+
+def test_schema_decoding():
+    from sc2reader.decoders import BitPackedDecoder, FastBitPackedDecoder, Array, Struct, compile_schema
+    assert compile_schema(Struct(tuple, {1: Array()})) is compile_schema(Struct(tuple, {1: Array()}))
+
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    contents = replay.archive.read_file('replay.details')
+    assert BitPackedDecoder(contents).read_schema() == BitPackedDecoder(contents).read_struct()
+    assert replay.players[0].uid == 3996787
+
+    stats_events = [event for event in replay.tracker_events if event.name == 'PlayerStatsEvent']
+    assert isinstance(stats_events[0].stats, tuple)
+    assert len(stats_events[0].stats) == 33
+
+    # Tuples are padded with None where keys are missing
+    for decoder_class in (BitPackedDecoder, FastBitPackedDecoder):
+        assert compile_schema(Struct(tuple))(decoder_class('\x05\x04\x00\x09\x02\x04\x09\x06')) == (1, None, 3)
+
+def test_skip_struct():
+    from sc2reader.decoders import BitPackedDecoder, FastBitPackedDecoder, Struct, SKIP
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=0)
+    contents = replay.archive.read_file('replay.tracker.events')
+    for decoder_class in (BitPackedDecoder, FastBitPackedDecoder):
+        reader, skipper = decoder_class(contents), decoder_class(contents)
+        while not reader.done():
+            reader.read_struct()
+            skipper.skip_struct()
+            assert reader.tell() == skipper.tell()
+        assert skipper.done()
+
+    details = BitPackedDecoder(replay.archive.read_file('replay.details')).read_struct()
+    contents = replay.archive.read_file('replay.details')
+    skipped = BitPackedDecoder(contents).read_schema(Struct(None, {0: SKIP}))
+    assert skipped[0] is None
+    assert skipped[1] == details[1]
+
+def test_typed_arrays():
+    import array
+    from sc2reader.decoders import BitPackedDecoder, FastBitPackedDecoder, Array, compile_schema
+    for decoder_class in (BitPackedDecoder, FastBitPackedDecoder):
+        # Arrays of vints and u8s, mixed with a blob, and too big for the typecode
+        assert compile_schema(Array(typecode='l'))(decoder_class('\x00\x06\x09\x02\x09\x05\x06\x03')) == array.array('l', [1, -2, 3])
+        assert compile_schema(Array(typecode='l'))(decoder_class('\x00\x06\x09\x02\x06\x03\x02\x04ab')) == [1, 3, 'ab']
+        assert compile_schema(Array(typecode='B'))(decoder_class('\x00\x04\x09\x02\x09\x03')) == [1, -1]
+
+    factory = sc2reader.factories.SC2Factory(decoder='fast')
+    replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    position_events = [event for event in replay.tracker_events if event.name == 'UnitPositionsEvent']
+    assert isinstance(position_events[0].items, array.array)
+    assert len(position_events[0].positions) == len(position_events[0].items)/3
+
+def test_unaligned_read_bytes():
+    from sc2reader.decoders import BitPackedDecoder, FastBitPackedDecoder
+    contents = ''.join(chr((i*37) & 0xFF) for i in range(300))
+    for decoder_class in (BitPackedDecoder, FastBitPackedDecoder):
+        bulk, single = decoder_class(contents), decoder_class(contents)
+        assert bulk.read_bits(3) == single.read_bits(3)
+        assert bulk.read_bytes(256) == ''.join(single.read_bytes(1) for i in range(256))
+        assert bulk.read_bits(13) == single.read_bits(13)
+
+def test_selection_masks():
+    from sc2reader.utils import iter_bits
+    from sc2reader.plugins.utils import UnitSelection
+    assert list(iter_bits(0b1011, 6)) == [True, True, False, True, False, False]
+    assert list(iter_bits(0b1011, 2)) == [True, True]
+
+    selection = UnitSelection(range(6))
+    assert selection.deselect('Mask', (0b101, 3))
+    assert selection.objects == [1, 3, 4, 5]
+    assert not selection.deselect('Mask', (0b1, 5))
+    assert selection.objects == [3, 4, 5]
+
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    masks = [event.mask_data for event in replay.game_events if getattr(event, 'mask_type', None) == 'Mask']
+    assert masks
+    for bit_mask, mask_length in masks:
+        assert 0 <= bit_mask < 1 << mask_length
+
+def test_reader_registry():
+    from sc2reader import readers
+    from sc2reader.utils import IntervalIndex
+    index = IntervalIndex([('a', [(None, 10), (None, None)]), ('b', [(10, 20), (None, None)]), ('c', [(15, None), (1, 2)])])
+    assert index.get((5, 1)) == 'a'
+    assert index.get((15, 0)) == 'b'
+    assert index.get((15, 1)) == 'c'
+    assert index.get((25, 0)) is None
+
+    replay1 = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    replay2 = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    assert replay1._get_reader('replay.game.events') is replay2._get_reader('replay.game.events')
+    assert replay1._get_datapack() is replay2._get_datapack() is not None
+
+    reader = readers.TrackerEventsReader_Base()
+    replay1.register_reader('replay.tracker.events', reader)
+    assert replay1._get_reader('replay.tracker.events') is reader
+    assert replay2._get_reader('replay.tracker.events') is not reader
+
+    # Subclasses register their own readers and datapacks before loading
+    from sc2reader.data import builds
+    class CustomReplay(sc2reader.resources.Replay):
+        def register_default_readers(self):
+            self.register_reader('replay.tracker.events', reader)
+
+        def register_default_datapacks(self):
+            self.register_datapack(builds['HotS']['base'])
+
+    replay = sc2reader._defaultFactory.load(CustomReplay, "test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    assert replay._get_reader('replay.tracker.events') is reader
+    assert replay.datapack is builds['HotS']['base'] is not replay1.datapack
+
+def test_game_event_table():
+    from sc2reader import readers
+    reader = readers.GameEventsReader_24247()
+    assert reader.get_event_width(reader.unknown_event) == 16
+    assert reader.get_event_width(reader.finished_loading_sync_event) == 0
+    assert reader.get_event_width(reader.bank_file_event) is None
+    assert reader.get_event_width(reader.selection_delta_event) is None
+
+    event_table = reader.get_event_table()
+    assert len(event_table) == 128
+    assert event_table[27] == reader.EVENT_DISPATCH[27]
+    assert event_table[8] == (None, None)
+    assert reader.get_event_table() is event_table
+
+def test_attribute_events():
+    from sc2reader.objects import AttributeData, lookup_attribute
+    assert lookup_attribute(3000, 'rsaF') == ('Game Speed', 'Faster')
+    assert lookup_attribute(3000, 'rsaF') is lookup_attribute(3000, 'rsaF')
+
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    attributes = replay.raw_data['replay.attributes.events']
+    assert all(isinstance(attribute, AttributeData) for attribute in attributes)
+    assert replay.attributes[16]['Game Speed'] == 'Faster'
+    last_values = dict(((attribute.player, attribute.name), attribute.value) for attribute in attributes)
+    for (player, name), value in last_values.items():
+        assert replay.attributes[player][name] == value
+
+def test_lazy_game_events():
+    from sc2reader.readers import GameEventSequence
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=3)
+    lazy_replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=3, lazy_events=True)
+    events = lazy_replay.game_events
+    assert isinstance(events, GameEventSequence)
+    assert len(events) == len(replay.game_events)
+    assert lazy_replay.frames == replay.frames
+
+    assert [event_summary(event, context=False) for event in events] == [event_summary(event, context=False) for event in replay.game_events]
+    assert event_summary(events[-1], context=False) == event_summary(replay.game_events[-1], context=False)
+    assert [event_summary(event, context=False) for event in events[1000:1010]] == [event_summary(event, context=False) for event in replay.game_events[1000:1010]]
+    assert [event_summary(event, context=False) for event in events.between(8000, 9000)] == [event_summary(event, context=False) for event in replay.game_events if 8000 <= event.frame < 9000]
+
+def test_event_type_filters():
+    from sc2reader.events import AbilityEvent, TargetAbilityEvent, SelectionEvent, UnitBornEvent
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4)
+
+    event_types = ('AbilityEvent', SelectionEvent, 'HotkeyEvent')
+    filtered = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4, event_types=event_types, tracker_event_types=[UnitBornEvent], message_event_types=[])
+    expected = [event for event in replay.game_events if isinstance(event, (AbilityEvent, SelectionEvent, sc2reader.events.HotkeyEvent))]
+    assert expected and [event_summary(event) for event in filtered.game_events] == [event_summary(event) for event in expected]
+    assert [event_summary(event) for event in filtered.tracker_events] == [event_summary(event) for event in replay.tracker_events if isinstance(event, UnitBornEvent)]
+    assert not filtered.messages and not filtered.pings and not filtered.packets
+
+    # Types only some of a factory's events belong to are filtered after construction
+    targeted = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=3, event_types=[TargetAbilityEvent])
+    expected = [event for event in replay.game_events if isinstance(event, TargetAbilityEvent)]
+    assert expected and [event_summary(event) for event in targeted.game_events] == [event_summary(event) for event in expected]
+    lazy = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=3, event_types=[TargetAbilityEvent], lazy_events=True)
+    assert [event_summary(event, context=False) for event in lazy.game_events] == [event_summary(event, context=False) for event in expected]
+
+    with pytest.raises(ValueError):
+        sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=3, event_types=['NotAnEvent'])
+
+def test_frame_window():
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4)
+    window = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4, min_frame=2000, max_frame=8000)
+
+    expected = [event for event in replay.events if 2000 <= event.frame <= 8000 or event.name == 'PacketEvent']
+    assert len(expected) < len(replay.events)
+    assert sorted(map(event_summary, window.events)) == sorted(map(event_summary, expected))
+
+    lazy = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=3, min_frame=2000, max_frame=8000, lazy_events=True)
+    assert [event_summary(event, context=False) for event in lazy.game_events] == [event_summary(event, context=False) for event in replay.game_events if 2000 <= event.frame <= 8000]
+
+    # Units born before the min_frame still have their owners and types
+    assert all(event.frame >= 2000 for event in window.tracker_events)
+    died = [event for event in window.tracker_events if event.name == 'UnitDiedEvent' and event.unit.started_at < 2000]
+    assert died
+    for event in died:
+        unit = replay.objects[event.unit_id]
+        assert (event.unit.name, event.unit.owner.pid, event.unit.started_at) == (unit.name, unit.owner.pid, unit.started_at)
+
+def test_frame_window_recorder():
+    for path in ["test_replays/1.2.2.17811/1.SC2Replay", "test_replays/2.0.0.24247/molten.SC2Replay"]:
+        replay = sc2reader.load_replay(path, load_level=2)
+        window = sc2reader.load_replay(path, load_level=2, min_frame=2000)
+        assert replay.recorder is not None
+        assert window.recorder.pid == replay.recorder.pid
+
+def test_merged_events():
+    from sc2reader.utils import merge_events
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4)
+    streams = [replay.tracker_events, replay.game_events, replay.messages, replay.pings, replay.packets]
+    assert replay.events == sorted(sum(streams, []), key=lambda e: e.frame)
+    assert list(replay.iter_events()) == replay.events
+
+    class Event(object):
+        def __init__(self, frame, name):
+            self.frame, self.name = frame, name
+
+    merged = merge_events([Event(1, 'a'), Event(3, 'b')], iter([Event(1, 'c'), Event(1, 'd'), Event(2, 'e')]), [])
+    assert [event.name for event in merged] == ['a', 'c', 'd', 'e', 'b']
+
+def test_event_query():
+    from sc2reader.events import AbilityEvent, UnitBornEvent
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4)
+    assert replay._event_index is None
+    assert replay.query() == replay.events
+    assert replay._event_index is not None
+    assert replay.events_by_type['UnitBornEvent'] == [event for event in replay.events if event.name == 'UnitBornEvent']
+
+    expected = [event for event in replay.events if isinstance(event, (AbilityEvent, UnitBornEvent)) and 1000 <= event.frame < 5000]
+    assert expected and replay.query(types=[AbilityEvent, 'UnitBornEvent'], frames=(1000, 5000)) == expected
+
+    expected = [event for event in replay.events if getattr(event, 'pid', None) == 1 and isinstance(event, AbilityEvent)]
+    assert expected and replay.query(types=['AbilityEvent'], pids=[1]) == expected
+    assert replay.query(frames=(5000, 5000)) == []
+
+def test_load_level_upgrade():
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=4)
+    upgraded = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    raw_details = upgraded.raw_data['replay.details']
+    assert upgraded.load_level == 1 and not upgraded.events
+
+    assert upgraded.load(3) is upgraded
+    assert upgraded.load_level == 3 and upgraded.tracker_events == []
+    upgraded.load(4)
+    assert upgraded.raw_data['replay.details'] is raw_details
+
+    assert map(event_summary, upgraded.events) == map(event_summary, replay.events)
+    assert sorted(upgraded.objects.keys()) == sorted(replay.objects.keys())
+    for player, expected in zip(upgraded.players, replay.players):
+        assert map(event_summary, player.events) == map(event_summary, expected.events)
+        assert len(player.units) == len(expected.units)
+        assert len(player.killed_units) == len(expected.killed_units)
+
+def test_peek_replay():
+    from StringIO import StringIO
+    for path in ["test_replays/1.2.2.17811/13.SC2Replay", "test_replays/2.0.8.25604/mlg1.SC2Replay"]:
+        replay = sc2reader.load_replay(path, load_level=0)
+        header = sc2reader.peek_replay(path)
+        assert header.versions == replay.versions
+        assert header.build == replay.build and header.base_build == replay.base_build
+        assert header.frames == replay.frames
+        assert header.release_string == replay.release_string
+
+    with open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb') as replay_file:
+        assert sc2reader.peek_replay(replay_file).build == 25604
+        assert replay_file.tell() < 1024
+
+    with pytest.raises(sc2reader.exceptions.MPQError):
+        sc2reader.peek_replay(StringIO("Not a replay"))
+
+def test_lazy_filehash():
+    import hashlib, zlib
+    with open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb') as replay_file:
+        contents = replay_file.read()
+
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=0)
+    assert replay._filehash is None
+    assert replay.filehash == hashlib.sha256(contents).hexdigest()
+
+    for algorithm, expected in [('md5', hashlib.md5(contents).hexdigest()), ('crc32', '{0:08x}'.format(zlib.crc32(contents) & 0xffffffff))]:
+        for mmap in (True, False):
+            replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=0, hash_algorithm=algorithm, mmap=mmap)
+            assert replay.filehash == expected
+
+    with pytest.raises(ValueError):
+        sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=0, hash_algorithm='not-a-hash')
+
+    # Files passed in are hashed before they can be closed
+    with open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb') as replay_file:
+        replay = sc2reader.load_replay(replay_file, load_level=1, hash_algorithm='md5')
+    assert replay.filehash == hashlib.md5(contents).hexdigest()
+
+def test_parsed_replay_cache(tmpdir, monkeypatch):
+    import mpyq
+    from sc2reader import utils
+    from sc2reader.factories import ParsedCacheSC2Factory
+    factory = ParsedCacheSC2Factory(str(tmpdir))
+    replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    assert len(tmpdir.listdir()) == 1
+    assert 'data_cache' not in replay.opt
+
+    # Cache hits don't extract and decode the data files again
+    extract_data_file = utils.extract_data_file
+    def extract_cached_data_file(data_file, archive):
+        assert data_file not in replay.raw_data
+        return extract_data_file(data_file, archive)
+    monkeypatch.setattr(utils, 'extract_data_file', extract_cached_data_file)
+    def open_archive(*args, **kwargs):
+        raise AssertionError("Opened the archive of a cached replay")
+    monkeypatch.setattr(mpyq, 'MPQArchive', open_archive)
+    cached_replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    monkeypatch.undo()
+
+    assert cached_replay.filehash == replay.filehash
+    assert map(event_summary, cached_replay.events) == map(event_summary, replay.events)
+    assert [player.name for player in cached_replay.players] == [player.name for player in replay.players]
+
+    # Different options are cached separately and the oldest entries are evicted
+    factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=2)
+    assert len(tmpdir.listdir()) == 2
+    factory.cache_max_size = 1
+    factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    assert sum(len(bucket.listdir()) for bucket in tmpdir.listdir()) == 0
+
+    # Entries from older cache formats aren't used
+    filehash = replay.filehash
+    options = dict(load_level=4)
+    cache_key = factory.get_parsed_cache_key(filehash, options)
+    monkeypatch.setattr(factory, 'cache_format', factory.cache_format+1)
+    assert factory.get_parsed_cache_key(filehash, options) != cache_key
+    monkeypatch.undo()
+
+    # Entries are keyed by sha256 whatever the hash_algorithm is
+    filehashes = list()
+    get_parsed_cache_key = factory.get_parsed_cache_key
+    def record_filehash(filehash, options):
+        filehashes.append(filehash)
+        return get_parsed_cache_key(filehash, options)
+    monkeypatch.setattr(factory, 'get_parsed_cache_key', record_filehash)
+    checksum_replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=2, hash_algorithm='crc32')
+    monkeypatch.undo()
+    assert filehashes == [filehash] and len(checksum_replay.filehash) == 8
+
+    # The cache is only scanned again once it may have grown too large
+    factory.cache_max_size = 10**9
+    factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=0)
+    def listdir(path):
+        raise AssertionError("Scanned the cache directory")
+    monkeypatch.setattr(os, 'listdir', listdir)
+    factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    monkeypatch.undo()
+    assert sum(len(bucket.listdir()) for bucket in tmpdir.listdir()) == 2
+
+def test_parsed_replay_cache_trust(tmpdir, caplog):
+    from sc2reader.factories import ParsedCacheSC2Factory
+    tmpdir.chmod(0o700)
+    ParsedCacheSC2Factory(str(tmpdir))
+    assert 'writable by other users' not in caplog.text
+
+    tmpdir.chmod(0o777)
+    ParsedCacheSC2Factory(str(tmpdir))
+    assert 'writable by other users' in caplog.text
+
+def test_lean_replays():
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    lean_replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", lean=True)
+    assert lean_replay.is_lean and lean_replay.archive is None and not lean_replay.raw_data
+    assert lean_replay.game_events is None and lean_replay.tracker_events is None
+    assert lean_replay.filehash == replay.filehash
+    assert len(lean_replay.events) == len(replay.events)
+    assert len(lean_replay.query(types=['UnitBornEvent'])) == len(replay.events_by_type['UnitBornEvent'])
+    assert list(lean_replay.iter_events()) == lean_replay.events
+
+    report, lean_report = replay.memory_report(), lean_replay.memory_report()
+    assert report.total == sum(size for name, size in report.items() if name != 'total')
+    assert report.archive == 0
+    assert sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1, mmap=False).memory_report().archive == os.path.getsize("test_replays/2.0.8.25604/mlg1.SC2Replay")
+    assert lean_report.archive == 0 and lean_report.raw_data < 1024 and lean_report.events_by_type < 1024
+    assert lean_report.events == report.events
+    assert lean_report.total < report.total
+
+    with pytest.raises(ValueError):
+        sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1, lean=True).load(2)
+
+def test_lean_replays_release_file():
+    import gc
+    import weakref
+    from StringIO import StringIO
+    with open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb') as replay_file:
+        source = StringIO(replay_file.read())
+    source_ref = weakref.ref(source)
+
+    replay = sc2reader.load_replay(source, lean=True)
+    filehash = replay.filehash
+    del source
+    gc.collect()
+    assert source_ref() is None
+    assert replay.memory_report().archive == 0
+    assert replay.filehash == filehash
+
+def test_lean_replays_close_mmap():
+    import mmap
+
+    class RecordingFactory(sc2reader.factories.SC2Factory):
+        def load_local_resource_contents(self, location, **options):
+            self.contents = super(RecordingFactory, self).load_local_resource_contents(location, **options)
+            return self.contents
+
+    factory = RecordingFactory()
+    replay = factory.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", lean=True)
+    assert isinstance(factory.contents, mmap.mmap)
+    with pytest.raises(ValueError):
+        factory.contents[0]
+    assert replay.filehash
+
+    # Memory maps that are passed in are left open
+    with open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb') as replay_file:
+        replay_map = mmap.mmap(replay_file.fileno(), 0, access=mmap.ACCESS_READ)
+    factory.load_replay(replay_map, lean=True)
+    assert replay_map[0] == 'M'
+    replay_map.close()
+
+def test_replays_close_mmap():
+    import hashlib
+    resource = pytest.importorskip('resource')
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip("Can't count open file descriptors")
+
+    # Keep more replays than there are file descriptors left
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = len(os.listdir('/proc/self/fd')) + 20
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    try:
+        replays = [sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1) for i in range(limit)]
+        open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb').close()
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    # The file is mapped again to load further and hashed from its path
+    replay = replays[0]
+    assert replay._file_object is None
+    assert replay.load(2).load_level == 2 and replay.messages
+    assert replay._file_object is None
+    with open("test_replays/2.0.8.25604/mlg1.SC2Replay", 'rb') as replay_file:
+        assert replays[1].filehash == hashlib.sha256(replay_file.read()).hexdigest()
+
+def test_lazy_datapacks():
+    import threading
+    from sc2reader.data import Builds, Build
+    builds = Builds('HotS', ('base', '24764'))
+    assert '24764' in builds and 'missing' not in builds and not builds._builds
+    assert sorted(builds.keys()) == ['24764', 'base'] and not builds._builds
+    with pytest.raises(KeyError):
+        builds['missing']
+
+    loaded = list()
+    threads = [threading.Thread(target=lambda: loaded.append(builds['24764'])) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert isinstance(loaded[0], Build) and all(build is loaded[0] for build in loaded)
+    assert builds._builds.keys() == ['24764']
+
+    replay = sc2reader.load_replay("test_replays/2.0.8.25604/mlg1.SC2Replay", load_level=1)
+    assert replay.datapack is sc2reader.data.builds['HotS']['24764']
+
+def test_datapack_snapshot(monkeypatch):
+    import sc2reader.data
+    from sc2reader.data import load_build, get_snapshot
+    assert 'HotS/24764' in get_snapshot()
+
+    def summary(build):
+        return (sorted((unit_id, unit.name) for unit_id, unit in build.units.items()),
+                sorted((ability_id, ability.name, getattr(ability.build_unit, 'name', None)) for ability_id, ability in build.abilities.items()))
+
+    snapshot_build = load_build('HotS', '24764')
+    monkeypatch.setattr(sc2reader.data, '_snapshot', dict())
+    assert summary(load_build('HotS', '24764')) == summary(snapshot_build)
+
+    # Data files older than the snapshot aren't hashed
+    hash_data_files = sc2reader.data._hash_data_files
+    def unhashed_data_files(data_files):
+        raise AssertionError("Hashed the data files")
+    monkeypatch.setattr(sc2reader.data, '_snapshot', None)
+    monkeypatch.setattr(sc2reader.data, '_data_files_changed', lambda: False)
+    monkeypatch.setattr(sc2reader.data, '_hash_data_files', unhashed_data_files)
+    assert 'HotS/24764' in get_snapshot()
+
+    # Otherwise builds that don't match their data files are ignored along
+    # with the builds based on them
+    def changed_data_files(data_files):
+        return 'changed' if 'HotS/24247_units.csv' in data_files else hash_data_files(data_files)
+    monkeypatch.setattr(sc2reader.data, '_snapshot', None)
+    monkeypatch.setattr(sc2reader.data, '_data_files_changed', lambda: True)
+    monkeypatch.setattr(sc2reader.data, '_hash_data_files', changed_data_files)
+    snapshot = get_snapshot()
+    assert 'HotS/23925' in snapshot and 'WoL/24944' in snapshot
+    assert 'HotS/24247' not in snapshot and 'HotS/24764' not in snapshot
+    assert summary(load_build('HotS', '24764')) == summary(snapshot_build)
+
+def test_datapack_deltas():
+    from sc2reader.data import read_build, read_snapshot_build, diff_build, patch_build, get_snapshot
+    base, build = read_build('HotS', 'base'), read_build('HotS', '24764')
+    changes = diff_build(base, build)
+    assert sum(len(entries) for start, end, entries in changes[0]) < len(build[0])
+    assert patch_build(base, changes) == build
+
+    snapshot = get_snapshot()
+    assert snapshot['HotS/24764'][1] == '24247'
+    assert read_snapshot_build('HotS', '24764') == build
+    assert read_snapshot_build('HotS', 'missing') is None
+
+def test_datapack_delta_chain(monkeypatch):
+    import sc2reader.data
+    from sc2reader.data import Builds, read_build
+    builds = Builds('HotS', ('base', '23925', '24247', '24764'))
+    builds['24764']
+    assert sorted(builds._tables) == ['23925', '24247', '24764', 'base']
+    assert builds._tables['24764'] == read_build('HotS', '24764')
+
+    # Builds before it in the chain reuse the tables patched for it
+    def patch_build(base, changes):
+        raise AssertionError("Patched a build again")
+    monkeypatch.setattr(sc2reader.data, 'patch_build', patch_build)
+    assert builds['24247'].units['Marine'] is builds['24764'].units['Marine']
+
+def test_shared_unit_types():
+    from sc2reader.data import builds, Unit, UnitType, AbilityType
+    hots, wol = builds['HotS']['24764'], builds['WoL']['24944']
+    assert isinstance(hots.units['Marine'], UnitType)
+    assert isinstance(hots.abilities[0], AbilityType)
+    assert hots.units['Marine'] is builds['HotS']['24247'].units['Marine']
+    assert hots.abilities[0] is wol.abilities[0]
+
+    unit = hots.create_unit(1, 'SiegeTank', 0, 10)
+    hots.change_type(unit, 'SiegeTankSieged', 20)
+    assert not unit.__dict__
+    unit.plugin_value = 1
+    assert unit.plugin_value == 1
+    assert unit.name == 'SiegeTankSieged' and unit.minerals == 150
+    assert unit.type_history.keys() == [10, 20]
+    assert unit.is_type(hots.units['SiegeTankSieged'])
+    assert unit.is_type('SiegeTank', strict=False)
+    assert not unit.is_type('SiegeTank')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Times ``import sc2reader`` in new interpreters. Run it with py.test to fail
+when importing sc2reader gets slow again compared to importing the modules
+it defers, or directly to print the timings.
+
+    python test_replays/test_import_time.py
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+#: The longest ``import sc2reader`` may take as a fraction of importing the
+#: modules it defers, measured on the same machine
+MAX_IMPORT_RATIO = 0.5
+
+#: Importing everything ``import sc2reader`` used to import
+EAGER_IMPORT = "import sc2reader.resources, sc2reader.factories, sc2reader.plugins, sc2reader.scripts"
+
+#: Modules that ``import sc2reader`` shouldn't import
+LAZY_MODULES = ('mpyq', 'urllib2', 'urlparse', 'xml.etree', 'sc2reader.factories', 'sc2reader.resources', 'sc2reader.readers', 'sc2reader.data', 'sc2reader.plugins', 'sc2reader.scripts')
+
+#: Modules that loading a replay's metadata shouldn't import
+REMOTE_MODULES = ('urllib2', 'urlparse', 'xml.etree', 'sc2reader.plugins', 'sc2reader.scripts')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPLAY = os.path.join(ROOT, 'test_replays', '2.0.8.25604', 'mlg1.SC2Replay')
+
+
+def run(code, **environ):
+    env = dict(os.environ, PYTHONPATH=ROOT, **environ)
+    return subprocess.check_output([sys.executable, '-c', code], cwd=ROOT, env=env, stderr=subprocess.STDOUT)
+
+def time_statement(statement, repeat=5):
+    """ Returns the fastest time to run the statement in a new interpreter """
+    code = "import time; start = time.time(); {0}; print(time.time() - start)".format(statement)
+    return min(float(run(code)) for i in range(repeat))
+
+def imported_modules(statement):
+    """ Returns the modules imported after running the statement in a new interpreter """
+    code = "import sys; {0}; print('\\n'.join(name for name, module in sys.modules.items() if module))".format(statement)
+    return set(run(code).split())
+
+
+def test_import_time():
+    assert time_statement("import sc2reader") < MAX_IMPORT_RATIO * time_statement(EAGER_IMPORT)
+
+def test_lazy_imports():
+    modules = imported_modules("import sc2reader")
+    assert not modules.intersection(LAZY_MODULES)
+
+def test_metadata_imports():
+    modules = imported_modules("import sc2reader; sc2reader.load_replay({0!r}, load_level=1)".format(REPLAY))
+    assert 'sc2reader.resources' in modules
+    assert not modules.intersection(REMOTE_MODULES)
+
+def test_bad_cache_dir():
+    missing = os.path.join(ROOT, 'test_replays', 'missing_cache_dir')
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run("import sc2reader", SC2READER_CACHE_DIR=missing)
+    assert 'ValueError' in error.value.output
+
+
+if __name__ == '__main__':
+    print("import sc2reader: {0:.4f}s".format(time_statement("import sc2reader")))
+    print("eager imports: {0:.4f}s".format(time_statement(EAGER_IMPORT)))
+    print("load_replay(load_level=1): {0:.4f}s".format(time_statement("import sc2reader; sc2reader.load_replay({0!r}, load_level=1)".format(REPLAY))))